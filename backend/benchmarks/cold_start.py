@@ -0,0 +1,71 @@
+# !/usr/bin/env python3
+# /// script
+# dependencies = [
+#   "httpx",
+# ]
+# ///
+"""
+Measure how long a freshly started worker takes until it serves its first requests.
+
+Each run starts a new interpreter that imports the app (which discovers all datasets),
+then requests `/infos` and a label mask for `--dataset`, and reports the time since the process started.
+Runs the app in-process (no network). Note that the OS page cache is still warm after the first run,
+so drop it in between (e.g. `echo 3 > /proc/sys/vm/drop_caches`) to measure truly cold disks.
+
+Usage (from the `backend` folder):
+    PYTHONPATH=. LITHUB_CONFIG=../.config/default.env python benchmarks/cold_start.py --dataset carbonpricing --label "tech|1"
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+async def child(args: argparse.Namespace, started: float) -> None:
+    import httpx
+
+    from server.__main__ import app
+
+    timings = {'import': time.perf_counter() - started}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as http:
+        (await http.get('/api/basic/infos')).raise_for_status()
+        timings['infos'] = time.perf_counter() - started
+        (await http.get('/api/basic/bitmask', params={'dataset': args.dataset, 'key': args.label})).raise_for_status()
+        timings['bitmask'] = time.perf_counter() - started
+    print(json.dumps(timings))
+
+
+def report(name: str, values: list[float]) -> None:
+    print(f'{name:>12}: n={len(values):>3} | p50={statistics.median(values) * 1000:9.2f}ms | min={min(values) * 1000:9.2f}ms | max={max(values) * 1000:9.2f}ms')
+
+
+def main(args: argparse.Namespace) -> None:
+    timings: dict[str, list[float]] = {}
+    for _ in range(args.runs):
+        cmd = [sys.executable, __file__, '--child', '--dataset', args.dataset, '--label', args.label]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        for key, value in json.loads(out.strip().splitlines()[-1]).items():
+            timings.setdefault(key, []).append(value)
+
+    print(f'Time since process start until ... ({args.runs} runs)')
+    for key, values in timings.items():
+        report(key, values)
+
+
+if __name__ == '__main__':
+    process_start = time.perf_counter()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--label', required=True, help='label column to request the mask for')
+    parser.add_argument('--runs', type=int, default=5, help='number of worker starts')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    main_args = parser.parse_args()
+    if main_args.child:
+        asyncio.run(child(main_args, process_start))
+    else:
+        main(main_args)
@@ -0,0 +1,90 @@
+# !/usr/bin/env python3
+# /// script
+# dependencies = [
+#   "httpx",
+# ]
+# ///
+"""
+Measure event loop lag of the API under mixed concurrent load.
+
+A ticker coroutine sleeps for a fixed interval and records how late it wakes up,
+while clients concurrently hit `/documents`, `/download`, `/bitmask` and `/search/bitmask`.
+Runs the app in-process (no network), so lag is caused by the server code alone.
+
+Usage (from the `backend` folder):
+    PYTHONPATH=. LITHUB_CONFIG=../.config/default.env python benchmarks/loop_lag.py --dataset carbonpricing --label "tech|1" --query carbon
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from server.__main__ import app
+
+
+async def ticker(lags: list[float], stop: asyncio.Event, interval: float) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def client(http: httpx.AsyncClient, args: argparse.Namespace, worker: int, durations: dict[str, list[float]]) -> None:
+    bitmask = (await http.get('/api/basic/bitmask', params={'dataset': args.dataset, 'key': args.label})).text
+    for i in range(args.requests):
+        kind = ['documents', 'bitmask', 'search', 'download'][(worker + i) % (4 if args.downloads else 3)]
+        start = time.perf_counter()
+        if kind == 'documents':
+            await http.post('/api/basic/documents', params={'dataset': args.dataset, 'limit': 100}, json={'bitmask': bitmask, 'order_by': [args.label]})
+        elif kind == 'bitmask':
+            # bypass the cache, so the database is actually hit
+            await http.get('/api/basic/bitmask', params={'dataset': args.dataset, 'key': args.label, 'min_score': 0.5 + i * 1e-6})
+        elif kind == 'search':
+            await http.get('/api/basic/search/bitmask', params={'dataset': args.dataset, 'query': args.query, 'fields': ['title', 'abstract']})
+        else:
+            await http.post('/api/basic/download', params={'dataset': args.dataset}, json={'bitmask': bitmask})
+        durations.setdefault(kind, []).append(time.perf_counter() - start)
+
+
+def report(name: str, values: list[float]) -> None:
+    values = sorted(values)
+    if len(values) == 0:
+        return
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+    print(f'{name:>12}: n={len(values):>6} | p50={statistics.median(values) * 1000:9.2f}ms | p99={p99 * 1000:9.2f}ms | max={values[-1] * 1000:9.2f}ms')
+
+
+async def main(args: argparse.Namespace) -> None:
+    lags: list[float] = []
+    durations: dict[str, list[float]] = {}
+    stop = asyncio.Event()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as http:
+        tick = asyncio.create_task(ticker(lags, stop, args.interval))
+        start = time.perf_counter()
+        await asyncio.gather(*[client(http, args, worker, durations) for worker in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await tick
+
+    print(f'Ran {args.concurrency} clients x {args.requests} requests in {elapsed:.2f}s')
+    report('loop lag', lags)
+    for kind, values in durations.items():
+        report(kind, values)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', required=True)
+    parser.add_argument('--label', required=True, help='label column to build masks from')
+    parser.add_argument('--query', default='climate', help='full-text search query')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=20, help='requests per client')
+    parser.add_argument('--interval', type=float, default=0.01, help='ticker interval in seconds')
+    parser.add_argument('--downloads', action='store_true', help='include /download in the request mix')
+    main_args = parser.parse_args()
+    asyncio.run(main(main_args))
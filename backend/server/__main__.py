@@ -1,4 +1,7 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
+from typing import AsyncGenerator
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -10,6 +13,7 @@ from .logging import get_logger
 from .config import settings
 from .middlewares import ErrorHandlingMiddleware, TimingMiddleware
 from .api import router as api_router, FilteredStaticFiles
+from .datasets import datasets
 
 import mimetypes
 
@@ -17,7 +21,25 @@ mimetypes.init()
 
 logger = get_logger('server')
 
-app = FastAPI(openapi_url=settings.OPENAPI_FILE, openapi_prefix=settings.OPENAPI_PREFIX, root_path=settings.ROOT_PATH)
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI) -> AsyncGenerator[None, None]:
+    watcher = None
+    if settings.DATASETS_WATCH_INTERVAL:
+        logger.info(f'Watching {settings.DATASETS_FOLDER} for changes every {settings.DATASETS_WATCH_INTERVAL}s')
+        watcher = asyncio.create_task(datasets.watch(settings.DATASETS_WATCH_INTERVAL))
+    elif settings.ADMIN_TOKEN:
+        # Otherwise, only the worker handling /api/admin/reload would reload
+        logger.info(f'Checking for reloads requested by other workers every {settings.DATASETS_RELOAD_CHECK_INTERVAL}s')
+        watcher = asyncio.create_task(datasets.watch(settings.DATASETS_RELOAD_CHECK_INTERVAL, marker_only=True))
+    yield
+    if watcher is not None:
+        watcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await watcher
+
+
+app = FastAPI(openapi_url=settings.OPENAPI_FILE, openapi_prefix=settings.OPENAPI_PREFIX, root_path=settings.ROOT_PATH, lifespan=lifespan)
 
 logger.debug('Setting up server and middlewares')
 mimetypes.add_type('application/javascript', '.js')
@@ -28,7 +50,12 @@ if settings.HEADER_TRUSTED_HOST:
     logger.info(f'TrustedHostMiddleware allows the following hosts: {settings.CORS_ORIGINS}')
 if settings.HEADER_CORS:
     app.add_middleware(
-        CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'POST', 'DELETE', 'POST', 'PUT', 'PATCH'], allow_headers=['*'], allow_credentials=True
+        CORSMiddleware,
+        allow_origins=['*'],
+        allow_methods=['GET', 'POST', 'DELETE', 'POST', 'PUT', 'PATCH'],
+        allow_headers=['*'],
+        allow_credentials=True,
+        expose_headers=['X-Next-Cursor'],
     )
     logger.info(f'CORSMiddleware will accept the following origins: {settings.CORS_ORIGINS}')
 app.add_middleware(GZipMiddleware, minimum_size=1000)
@@ -6,7 +6,7 @@ import logging
 
 from starlette.types import Send, Receive, Scope
 
-from . import basic
+from . import admin, basic
 
 logger = logging.getLogger('api')
 
@@ -14,6 +14,7 @@ logger = logging.getLogger('api')
 router = APIRouter()
 
 router.include_router(basic.router, prefix='/basic', tags=['basic'])
+router.include_router(admin.router, prefix='/admin', tags=['admin'])
 
 
 class FilteredStaticFiles(StaticFiles):
@@ -24,7 +25,9 @@ class FilteredStaticFiles(StaticFiles):
         assert scope['type'] == 'http'
 
         path = scope.get('path', '')[len(scope.get('root_path', '')) + 1 :]
-        if path.endswith('info.json') or path.count('/') > 1:
+        # Only the dataset files themselves are public, not their meta-data (info.json, manifest.json) or derived sidecars
+        name = path.rsplit('/', 1)[-1]
+        if path.count('/') > 1 or name.startswith('.') or name.endswith(('.json', '.npy')):
             logger.warning(f'Someone tried to access: {path}, which is forbidden.')
             raise HTTPException(status_code=http_status.HTTP_403_FORBIDDEN)
 
@@ -0,0 +1,29 @@
+import secrets
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status as http_status
+
+from ..config import settings
+from ..datasets import ReloadSummary, datasets as dataset_cache
+
+router = APIRouter()
+
+
+def ensure_admin(authorization: Annotated[str | None, Header()] = None) -> None:
+    if settings.ADMIN_TOKEN is None:
+        # Admin endpoints are disabled unless a token is configured
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND)
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not secrets.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=http_status.HTTP_401_UNAUTHORIZED, headers={'WWW-Authenticate': 'Bearer'})
+
+
+@router.post('/reload', response_model=ReloadSummary, dependencies=[Depends(ensure_admin)])
+async def reload_datasets() -> ReloadSummary:
+    """
+    Reload datasets in this worker and ask all other workers to do the same; they pick it up within
+    `DATASETS_WATCH_INTERVAL` (or `DATASETS_RELOAD_CHECK_INTERVAL`) seconds.
+    """
+    summary = await dataset_cache.refresh()
+    dataset_cache.request_reload()
+    return summary
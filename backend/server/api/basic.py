@@ -1,149 +1,353 @@
-import csv
-import io
+import asyncio
 import logging
 from sqlite3 import Cursor
 from typing import Generator, Annotated, Literal
 
+import numpy as np
+
 from fastapi import APIRouter, Query, HTTPException, Body, Depends, status as http_status, BackgroundTasks
-from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
 from pydantic import BaseModel
 
+from ..bitmask import Bitmask
+from ..cache import cache
 from ..config import settings
+from ..cube import Cube
 from ..datasets import DatasetInfoWeb, datasets as dataset_cache, Dataset
+from ..db import PoolStats, run_in_executor
 from ..mails import send_message, EmailNotSentError
 from lithub.models import AnnotatedDocument
-from ..util import as_bitmask, as_ids
-from ..cache import cache
-from ..cache.coders import BytesCoder, JsonCoder
+from ..util import IDS_FILTER, ids_param
+from ..export import Compression, ExportFormatKey, ExportJob, arrow_schema, coalesce, export, exports, fetch_batches
+from ..export import filename as export_filename, media_type as export_media_type
+from ..facets import Facets, facets_from_db, facets_from_scores
+from ..search import SearchHit, ranked_matches
+from ..vocabulary import Suggestion
+from ..ordering import InvalidCursorError, decode_cursor, encode_cursor, page_in_order
+from ..masks import MaskExpression, LabelLeaf, SearchLeaf, count_nodes, evaluate
+from .transport import MaskBody, ids_response, mask_response, parse_mask_body, payload_response
 
 logger = logging.getLogger('api.basic')
 router = APIRouter()
-datasets = dataset_cache.datasets
 
 
 def ensure_dataset(dataset: str = Query()) -> Dataset:
-    if dataset in datasets:
-        return datasets[dataset]
+    # Always look datasets up at request time, they may have been swapped since (see `DatasetCache.refresh`)
+    ds = dataset_cache.datasets.get(dataset)
+    if ds is not None:
+        # FastAPI runs sync dependencies in its threadpool, so the size of datasets without a manifest
+        # (a `COUNT` query on first access) is resolved here rather than on the event loop
+        _ = ds.total
+        return ds
     raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND)
 
 
 @router.get('/infos', response_model=list[DatasetInfoWeb])
-async def get_datasets() -> list[DatasetInfoWeb]:
-    return [ds.info for ds in datasets.values()]
+async def get_datasets(request: Request) -> Response:
+    return payload_response(request, await run_in_executor(lambda: dataset_cache.infos_payload))
 
 
 @router.get('/info', response_model=DatasetInfoWeb)
-async def get_dataset(dataset: Annotated[Dataset, Depends(ensure_dataset)]) -> DatasetInfoWeb:
-    return dataset.info
+async def get_dataset(request: Request, dataset: Annotated[Dataset, Depends(ensure_dataset)]) -> Response:
+    return payload_response(request, await run_in_executor(lambda: dataset.info_payload))
+
+
+class DatasetStats(BaseModel):
+    pool: PoolStats
+
+
+@router.get('/stats', response_model=dict[str, DatasetStats])
+async def get_stats() -> dict[str, DatasetStats]:
+    return {key: DatasetStats(pool=ds.pool.stats) for key, ds in dataset_cache.datasets.items()}
 
 
 @router.get('/bitmask', response_class=PlainTextResponse)
-@cache(coder=BytesCoder)
-async def get_bitmask(dataset: Annotated[Dataset, Depends(ensure_dataset)], key: str, min_score: float = 0.5) -> bytes:
-    with dataset as db:
-        rslt = db.cur.execute(f'SELECT idx FROM documents WHERE {db.safe_col(key)} >= :min_score ORDER BY idx;', {'min_score': min_score})
-        mask = as_bitmask((r['idx'] for r in rslt), dataset.total)
-        return mask
+async def get_bitmask(request: Request, dataset: Annotated[Dataset, Depends(ensure_dataset)], key: str, min_score: float = 0.5) -> Response:
+    mask = await evaluate(dataset, LabelLeaf(label=key, min_score=min_score))
+    return mask_response(request, mask)
 
 
-@router.get('/bitmask/ids')
-@cache(coder=JsonCoder)
-async def get_ids(dataset: Annotated[Dataset, Depends(ensure_dataset)], key: str, min_score: float = 0.5) -> list[int]:
-    with dataset as db:
-        rslt = db.cur.execute(f'SELECT idx FROM documents WHERE {db.safe_col(key)} >= :min_score ORDER BY idx;', {'min_score': min_score})
-        return [r['idx'] for r in rslt]
+@router.get('/bitmask/ids', response_model=list[int])
+async def get_ids(request: Request, dataset: Annotated[Dataset, Depends(ensure_dataset)], key: str, min_score: float = 0.5) -> Response:
+    mask = await evaluate(dataset, LabelLeaf(label=key, min_score=min_score))
+    return ids_response(request, mask)
 
 
 @router.get('/search/bitmask', response_class=PlainTextResponse)
 async def get_search_mask(
+    request: Request,
     dataset: Annotated[Dataset, Depends(ensure_dataset)],
     query: str,
     fields: Annotated[list[str], Query()],
-) -> bytes:
-    with dataset as db:
-        field_filters = [f'{db.safe_col(field)} MATCH :query' for field in fields]
-        rslt = db.cur.execute(f'SELECT idx FROM search WHERE {" OR ".join(field_filters)} ORDER BY idx;', {'query': query})
-        mask = as_bitmask((r['idx'] for r in rslt), dataset.total)
-        return mask
+) -> Response:
+    mask = await evaluate(dataset, SearchLeaf(search=query, fields=fields))
+    return mask_response(request, mask)
+
+
+@router.post('/mask', response_class=PlainTextResponse)
+async def get_mask(request: Request, dataset: Annotated[Dataset, Depends(ensure_dataset)], expression: Annotated[MaskExpression, Body()]) -> Response:
+    """
+    Evaluate a mask expression and return the resulting bitmask, e.g.
+    `{"and": [{"group": "tech"}, {"not": {"search": "tax"}}, {"years": [2010, null]}]}`
+    Leaves are `label` (+ `min_score`), `group` (+ `min_score`), `search` (+ `fields`), `years` ranges, and client-side `bitmask`s;
+    they can be combined with `and`, `or`, and `not`.
+    """
+    if count_nodes(expression) > settings.MASK_MAX_NODES:
+        raise HTTPException(400, detail='Mask expression is too large')
+    mask = await evaluate(dataset, expression)
+    return mask_response(request, mask)
+
+
+class SearchBody(MaskBody):
+    query: str
+    fields: list[str] | None = None
+
+
+@router.post('/search', response_model=list[SearchHit], openapi_extra=SearchBody.openapi())
+async def search(
+    request: Request,
+    dataset: Annotated[Dataset, Depends(ensure_dataset)],
+    limit: int = 10,
+    page: int = 0,
+) -> list[SearchHit]:
+    """
+    Full-text search for `query` (FTS5 syntax) in `fields` (default: all), best matches (BM25) first, with highlighted snippets.
+    If `bitmask` is given, only documents in it are considered.
+    """
+    if limit > 100:
+        raise HTTPException(400, detail='Maximum number of documents exceeded')
+    body = await parse_mask_body(request, SearchBody, dataset.total)
+    mask = body.get_mask(dataset.total)
+
+    def query(cur: Cursor) -> list[SearchHit]:
+        matches = ranked_matches(cur, dataset, body.query, body.fields, mask, limit=limit, offset=page * limit)
+        if len(matches) == 0:
+            return []
+        rslt = cur.execute(f'SELECT * FROM documents WHERE {IDS_FILTER};', {'ids': ids_param(idx for idx, _, _ in matches)})
+        documents = {doc.idx: doc for doc in convert_documents(rslt, dataset)}
+        return [SearchHit(score=score, snippet=snippet, document=documents[idx]) for idx, score, snippet in matches if idx in documents]
+
+    return await dataset.run(query)
 
 
-@router.post('/documents', response_model=list[AnnotatedDocument])
+@router.get('/suggest', response_model=list[Suggestion])
+async def suggest(
+    dataset: Annotated[Dataset, Depends(ensure_dataset)],
+    prefix: str,
+    limit: Annotated[int, Query(ge=1, le=50)] = 10,
+) -> list[Suggestion]:
+    """
+    Most frequent search terms starting with the last word of `prefix` (for type-ahead), with their document counts.
+    This is answered from memory without touching the database (once the vocabulary was loaded).
+    """
+    words = prefix.split()
+    # The first access loads the vocabulary from the index (or waits for the warm-up to do so), keep that off the event loop
+    vocabulary = await run_in_executor(lambda: dataset.vocabulary)
+    if len(words) == 0 or vocabulary is None or prefix[-1].isspace():
+        return []
+    return vocabulary.complete(words[-1], limit)
+
+
+@router.post('/facets', response_model=Facets, openapi_extra=MaskBody.openapi())
+async def get_facets(request: Request, dataset: Annotated[Dataset, Depends(ensure_dataset)], min_score: float = 0.5) -> Facets:
+    """
+    Number of documents in `bitmask` (or overall) per label and group (scored at least `min_score`) and per publication year.
+    """
+    body = await parse_mask_body(request, MaskBody, dataset.total)
+    mask = body.get_mask(dataset.total)
+    if await run_in_executor(lambda: dataset.scores) is not None:
+        return await run_in_executor(facets_from_scores, dataset, mask, min_score)
+    return await dataset.run(facets_from_db, dataset, mask, min_score)
+
+
+def cube_threshold(min_score: Annotated[float, Query(ge=0, le=1)] = 0.5) -> float:
+    # Rounded, so arbitrary thresholds can not make us compute (and cache) an unbounded number of cubes
+    return round(min_score, 2)
+
+
+@router.get('/cube', response_model=Cube)
+@cache(namespace='cube', expire=settings.CUBE_CACHE_EXPIRE)
+async def get_cube(dataset: Annotated[Dataset, Depends(ensure_dataset)], min_score: Annotated[float, Depends(cube_threshold)]) -> Cube:
+    """
+    Number of documents per label and group (scored at least `min_score`, rounded to two decimals) and publication year, e.g. for heatmaps.
+    """
+    cube = await run_in_executor(dataset.cube, min_score)
+    if cube is None:
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail='No label scores available for this dataset.')
+    return cube
+
+
+class DocumentsBody(MaskBody):
+    ids: list[int] | None = None
+    order_by: list[str] | None = None
+    cursor: str | None = None  # continuation token from the `X-Next-Cursor` header of the previous page
+
+
+@router.post('/documents', response_model=list[AnnotatedDocument], openapi_extra=DocumentsBody.openapi())
 async def get_documents(
+    request: Request,
+    response: Response,
     dataset: Annotated[Dataset, Depends(ensure_dataset)],
-    bitmask: Annotated[str | None, Body()] = None,
-    ids: Annotated[list[int] | None, Body()] = None,
-    order_by: Annotated[list[str] | None, Body()] = None,
     limit: int = 10,
     page: int = 0,
 ) -> list[AnnotatedDocument]:
+    """
+    Page through documents (optionally restricted to a mask or list of ids), ordered by id or by descending relevance for `order_by`.
+    If present, pass the `X-Next-Cursor` response header as `cursor` to get the next page in constant time; `page` is ignored then.
+    """
     if limit > 100:
         raise HTTPException(400, detail='Maximum number of documents exceeded')
 
-    with dataset as db:
-        order_fields = ''  # TODO: Do we want default ordering on something?
-        where = ''
-        if order_by is not None and len(order_by) > 0:
-            logger.debug('Checking if some ')
-            order_by = [lab for ob in order_by for lab in dataset.unwrap_column(ob)]
-            valid_order_fields = [field for field in [db.safe_col_silent(ob) for ob in order_by] if field is not None]
-            logger.debug(f'Requested order fields: {order_by} / valid of order fields: {valid_order_fields}')
-            if len(valid_order_fields) > 0:
-                order_fields = f'ORDER BY ({" + ".join(valid_order_fields)}) DESC'
-        if bitmask is not None and len(bitmask) > 0:
-            ids = as_ids(bitmask)
-        if ids is not None and len(ids) > 0:
-            # casting to int first, so any SQL injection attempt would blow up
-            ids_str = ','.join([str(int(i)) for i in ids])
-            where = f'WHERE idx IN ({ids_str})'
-        stmt = f'SELECT * FROM documents {where} {order_fields} LIMIT :limit OFFSET :offset;'
-        # logger.debug(stmt)
-        rslt = db.cur.execute(stmt, {'limit': limit, 'offset': page * limit})
-        return list(convert_documents(rslt, dataset))
+    body = await parse_mask_body(request, DocumentsBody, dataset.total)
+    ids = body.ids
+    order_by = body.order_by
+    mask = body.get_mask(dataset.total)
+    if mask is None and ids is not None and len(ids) > 0:
+        requested = np.array(ids, dtype=np.int64)
+        mask = Bitmask.from_ids(requested[(requested >= 0) & (requested < dataset.total)], dataset.total)
+
+    order_labels: list[str] = []
+    if order_by is not None and len(order_by) > 0:
+        logger.debug('Checking if some ')
+        order_labels = [lab for ob in order_by for lab in dataset.unwrap_column(ob) if dataset.safe_col_silent(lab) is not None]
+        logger.debug(f'Requested order fields: {order_by} / valid of order fields: {order_labels}')
+
+    # Relevance orders are precomputed from the label scores, so pages are found by walking the order from a cursor.
+    # Single labels or groups are typical (and bounded in number), so only those are persisted as sidecars.
+    order = None
+    if len(order_labels) > 0:
+        order = await run_in_executor(dataset.order, order_labels, len(order_by or []) == 1)
+
+    if len(order_labels) > 0 and order is None:
+        # Fallback for ordering by something other than label scores
+        if body.cursor is not None:
+            raise InvalidCursorError('Cursors are not supported for this ordering')
+        order_fields = f'ORDER BY ({" + ".join(dataset.safe_col(lab) for lab in order_labels)}) DESC'
+        params: dict[str, str | int] = {'limit': limit, 'offset': page * limit}
+        if mask is None:
+            stmt = f'SELECT * FROM documents {order_fields} LIMIT :limit OFFSET :offset;'
+        else:
+            params['ids'] = ids_param(await run_in_executor(mask.ids))
+            stmt = f'SELECT * FROM documents WHERE {IDS_FILTER} {order_fields} LIMIT :limit OFFSET :offset;'
+
+        def query(cur: Cursor) -> list[AnnotatedDocument]:
+            return list(convert_documents(cur.execute(stmt, params), dataset))
+
+        return await dataset.run(query)
+
+    if body.cursor is not None:
+        start, skip = decode_cursor(body.cursor, dataset.version), 0
+    else:
+        start, skip = 0, page * limit
+    page_ids, next_pos = await run_in_executor(page_in_order, order, mask, dataset.total, start, limit, skip)
+    if next_pos is not None:
+        response.headers['X-Next-Cursor'] = encode_cursor(dataset.version, next_pos)
+
+    def query_page(cur: Cursor) -> list[AnnotatedDocument]:
+        documents = {
+            doc.idx: doc for doc in convert_documents(cur.execute(f'SELECT * FROM documents WHERE {IDS_FILTER};', {'ids': ids_param(page_ids)}), dataset)
+        }
+        return [documents[idx] for idx in page_ids.tolist() if idx in documents]
+
+    return await dataset.run(query_page)
 
 
 class CFR(StreamingResponse):  # custom file response to set the media type
     media_type = 'application/csv'
 
 
-@router.post('/download', response_class=CFR)
+class TooManyDownloadsError(Exception):
+    status = 503
+
+
+# Downloads hold a database connection and an executor thread while they are streaming, so limit how many run at once
+download_slots = asyncio.Semaphore(settings.DOWNLOAD_MAX_CONCURRENT)
+
+
+class DownloadResponse(StreamingResponse):
+    """
+    Streaming response that holds a download slot while it is sent (until it is done, failed, or the client went away).
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async with download_slots:
+            await super().__call__(scope, receive, send)
+
+
+class DownloadBody(MaskBody):
+    anyway: str | None = None
+
+
+@router.post('/download', response_class=CFR, openapi_extra=DownloadBody.openapi())
 async def get_download(
-    dataset: Annotated[Dataset, Depends(ensure_dataset)], bitmask: str | None = Body(default=None), anyway: str | None = Body(default=None)
+    request: Request,
+    dataset: Annotated[Dataset, Depends(ensure_dataset)],
+    format: ExportFormatKey = 'csv',
+    compression: Compression | None = None,
 ) -> StreamingResponse:
-    where = ''
-    if bitmask is not None and len(bitmask) > 0:
-        ids = as_ids(bitmask)
-        ids_str = ','.join([str(int(i)) for i in ids])
-        where = f'WHERE idx IN ({ids_str})'
-    stmt = f'SELECT * FROM documents {where} ORDER BY idx;'
+    """
+    Export all documents (or those in `bitmask`) as CSV, newline-delimited JSON, Arrow IPC stream, or Parquet.
+    With `compression=zstd`, Arrow and Parquet use their internal compression, other formats are sent as `.zst` file.
+    """
+    body = await parse_mask_body(request, DownloadBody, dataset.total)
+    mask = body.get_mask(dataset.total)
 
     cols = list(dataset.document_columns) + list(dataset.label_columns)
 
-    def streamer() -> Generator[str, None, None]:
-        with dataset as db:
-            rslt = db.cur.execute(stmt)
-            stream = io.StringIO()
-            writer = csv.DictWriter(stream, fieldnames=cols, lineterminator='\n')
-            writer.writeheader()
-            yield stream.getvalue()
+    def encode(cur: Cursor) -> Generator[bytes, None, None]:
+        chunks = export(fetch_batches(cur, mask, settings.DOWNLOAD_BUFFER), arrow_schema(cur, cols), format, compression)
+        yield from coalesce(chunks, settings.DOWNLOAD_CHUNK_SIZE)
 
-            n_buffered = 0
-            pos = stream.tell()
-            for row in rslt:
-                n_buffered += 1
-                writer.writerow({k: row[k] for k in cols})
+    # Fail fast rather than queueing; the slot itself is only taken once the response is sent, so it can't leak
+    if download_slots.locked():
+        raise TooManyDownloadsError('Too many downloads running, please try again in a moment.')
 
-                if n_buffered > settings.DOWNLOAD_BUFFER:
-                    stream.seek(pos)
-                    yield stream.read()
-                    pos = stream.tell()
+    # Chunks are produced in the database executor one at a time as the client consumes them;
+    # when the client disconnects, Starlette cancels the stream and the query gets interrupted.
+    response = DownloadResponse(dataset.iterate(encode), media_type=export_media_type(format, compression))
+    response.headers['Content-Disposition'] = f'attachment; filename={export_filename(dataset.key, format, compression)}'
 
-            stream.seek(pos)
-            yield stream.read()
+    return response
 
-    response = StreamingResponse(streamer(), media_type='text/csv')
-    response.headers['Content-Disposition'] = f'attachment; filename={dataset.key}.csv'
 
-    return response
+@router.post('/export', response_model=ExportJob, openapi_extra=MaskBody.openapi())
+async def create_export(
+    request: Request,
+    response: Response,
+    dataset: Annotated[Dataset, Depends(ensure_dataset)],
+    format: ExportFormatKey = 'csv',
+    compression: Compression | None = None,
+) -> ExportJob:
+    """
+    Start exporting all documents (or those in `bitmask`) in the background, see `/download` for the parameters.
+    Poll `/export/{key}` until the job is done and then fetch the file from `/export/{key}/file`.
+    Exports of the same selection are only computed once.
+    """
+    body = await parse_mask_body(request, MaskBody, dataset.total)
+    job = await exports.submit(dataset, body.get_mask(dataset.total), format, compression)
+    if job.status != 'done':
+        response.status_code = http_status.HTTP_202_ACCEPTED
+    return job
+
+
+@router.get('/export/{key}', response_model=ExportJob)
+async def get_export(key: str) -> ExportJob:
+    job = await run_in_executor(exports.get, key)
+    if job is None:
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND)
+    return job
+
+
+@router.get('/export/{key}/file', response_class=FileResponse)
+async def get_export_file(key: str) -> FileResponse:
+    job = await run_in_executor(exports.get, key)
+    if job is None or job.status != 'done':
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND)
+    # FileResponse handles Range requests and ETags, and uses sendfile where the server supports it
+    return FileResponse(exports.path(key), media_type=export_media_type(job.format, job.compression), filename=job.filename)
 
 
 class FeedbackValue(BaseModel):
@@ -0,0 +1,173 @@
+import json
+import types
+from typing import Any, Callable, TypeVar, Union, get_args, get_origin
+
+from fastapi import HTTPException, status as http_status
+from pydantic import BaseModel, ValidationError
+from starlette.requests import Request
+from starlette.responses import Response
+
+from ..bitmask import Bitmask
+from ..util import Payload, content_etag, etag_matches
+
+M = TypeVar('M', bound=BaseModel)
+
+MEDIA_BASE64 = 'text/plain'
+MEDIA_RAW = 'application/octet-stream'
+MEDIA_RLE = 'application/x-lithub-rle'
+MEDIA_ROARING = 'application/x-roaring'
+MEDIA_JSON = 'application/json'
+MEDIA_DELTA_VARINT = 'application/x-lithub-delta-varint'
+
+# Encoders for bitmask payloads; the first one is the default
+MASK_ENCODERS: dict[str, Callable[[Bitmask], bytes]] = {
+    MEDIA_BASE64: lambda mask: mask.to_base64(),
+    MEDIA_RAW: lambda mask: mask.to_bytes(),
+    MEDIA_RLE: lambda mask: mask.to_rle(),
+    MEDIA_ROARING: lambda mask: mask.to_roaring(),
+}
+
+MASK_DECODERS: dict[str, Callable[[bytes, int], Bitmask]] = {
+    MEDIA_RAW: lambda body, total: Bitmask.from_bytes(body, total),
+    MEDIA_RLE: Bitmask.from_rle,
+    MEDIA_ROARING: Bitmask.from_roaring,
+}
+
+# Encoders for lists of document ids; the first one is the default
+IDS_ENCODERS: dict[str, Callable[[Bitmask], bytes]] = {
+    MEDIA_JSON: lambda mask: json.dumps(mask.ids().tolist()).encode(),
+    MEDIA_DELTA_VARINT: lambda mask: mask.to_delta_varints(),
+}
+
+
+def media_type(header: str | None) -> str:
+    return (header or '').split(';')[0].strip().lower()
+
+
+def negotiate(request: Request, offers: list[str]) -> str:
+    """
+    Pick the media type from `offers` the client prefers most according to its `Accept` header.
+    Falls back to the first offer (no header, wildcards, or nothing acceptable).
+    """
+    best, best_q = offers[0], 0.0
+    for part in request.headers.get('accept', '').split(','):
+        mtype, *params = part.split(';')
+        mtype = mtype.strip().lower()
+        if mtype not in offers:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = mtype, q
+    return best
+
+
+def _encoded_response(request: Request, content: bytes, mtype: str) -> Response:
+    etag = content_etag(content)
+    headers = {'ETag': etag, 'Vary': 'Accept'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type=mtype, headers=headers)
+
+
+def _accepts_gzip(request: Request) -> bool:
+    for part in request.headers.get('accept-encoding', '').split(','):
+        coding, _, q = part.partition(';')
+        if coding.strip().lower() == 'gzip':
+            return q.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+def payload_response(request: Request, payload: Payload) -> Response:
+    """
+    Respond with a pre-serialised `payload` (gzip-compressed if the client accepts it), or 304 if the client has it already.
+    """
+    gzipped = _accepts_gzip(request)
+    etag = payload.gzipped_etag if gzipped else payload.etag
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=http_status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if gzipped:
+        return Response(content=payload.gzipped, media_type=payload.media_type, headers={**headers, 'Content-Encoding': 'gzip'})
+    return Response(content=payload.content, media_type=payload.media_type, headers=headers)
+
+
+def mask_response(request: Request, mask: Bitmask) -> Response:
+    """
+    Respond with `mask` encoded as base64 text (default), raw bits, run-length, or roaring bitmap, depending on `Accept`.
+    """
+    mtype = negotiate(request, list(MASK_ENCODERS.keys()))
+    return _encoded_response(request, MASK_ENCODERS[mtype](mask), mtype)
+
+
+def ids_response(request: Request, mask: Bitmask) -> Response:
+    """
+    Respond with the ids set in `mask` as JSON list (default) or delta-varint encoded, depending on `Accept`.
+    """
+    mtype = negotiate(request, list(IDS_ENCODERS.keys()))
+    return _encoded_response(request, IDS_ENCODERS[mtype](mask), mtype)
+
+
+class MaskBody(BaseModel):
+    """
+    Base for request bodies carrying an (optional) base64 `bitmask`.
+
+    Clients may instead send the mask as binary request body (see `MASK_DECODERS`);
+    in that case, all other fields are read from the query string.
+    """
+
+    bitmask: str | None = None
+
+    _mask: Bitmask | None = None
+
+    def get_mask(self, total: int) -> Bitmask | None:
+        if self._mask is None and self.bitmask is not None and len(self.bitmask) > 0:
+            self._mask = Bitmask.from_base64(self.bitmask, total)
+        return self._mask
+
+    @classmethod
+    def openapi(cls) -> dict[str, Any]:
+        binary = {'schema': {'type': 'string', 'format': 'binary'}}
+        return {
+            'requestBody': {
+                'content': {
+                    MEDIA_JSON: {'schema': cls.model_json_schema()},
+                    **dict.fromkeys(MASK_DECODERS.keys(), binary),
+                },
+            },
+        }
+
+
+def _is_list(annotation: Any) -> bool:
+    if get_origin(annotation) in (Union, types.UnionType):
+        return any(_is_list(arg) for arg in get_args(annotation))
+    return get_origin(annotation) is list
+
+
+async def parse_mask_body(request: Request, model: type[M], total: int) -> M:
+    """
+    Parse the request body into `model` (a `MaskBody`), either from JSON or from a binary mask plus query parameters.
+    """
+    mtype = media_type(request.headers.get('content-type'))
+    body = await request.body()
+    try:
+        if mtype in MASK_DECODERS:
+            fields = {
+                name: request.query_params.getlist(name) if _is_list(field.annotation) else request.query_params[name]
+                for name, field in model.model_fields.items()
+                if name in request.query_params
+            }
+            parsed = model.model_validate(fields)
+            parsed._mask = MASK_DECODERS[mtype](body, total)  # type: ignore[attr-defined]
+            return parsed
+        if len(body) == 0:
+            return model()
+        return model.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(status_code=http_status.HTTP_422_UNPROCESSABLE_CONTENT, detail=e.errors(include_url=False))
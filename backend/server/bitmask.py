@@ -0,0 +1,288 @@
+import base64
+import struct
+from typing import Generator, Iterable
+
+import numpy as np
+import numpy.typing as npt
+
+# Cookie of the portable roaring bitmap format without run containers
+# https://github.com/RoaringBitmap/RoaringFormatSpec
+ROARING_COOKIE = 12346
+ROARING_CHUNK = 1 << 16
+ROARING_ARRAY_MAX = 4096
+
+
+def encode_varints(values: npt.NDArray[np.int64]) -> bytes:
+    """
+    Encode non-negative integers as unsigned LEB128 varints (7 bits per byte, high bit set on all but the last byte).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        n_bytes += values >= (np.uint64(1) << np.uint64(shift))
+    positions = np.cumsum(n_bytes) - n_bytes
+    out = np.zeros(int(n_bytes.sum()), dtype=np.uint8)
+    for k in range(int(n_bytes.max())):
+        sel = n_bytes > k
+        payload = (values[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n_bytes[sel] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[positions[sel] + k] = payload | more
+    return out.tobytes()
+
+
+def decode_varints(buffer: bytes | bytearray | memoryview) -> npt.NDArray[np.int64]:
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if data[-1] & 0x80:
+        raise ValueError('Truncated varint sequence')
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    # position of each byte within its varint
+    value_of_byte = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    shifts = (np.arange(len(data)) - starts[value_of_byte]) * 7
+    payload = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(payload, starts).astype(np.int64)
+
+
+class Bitmask:
+    """
+    Set of document ids in `[0, total)` stored as packed bits.
+
+    The byte layout is the one used by the API (and frontend): an array of little-endian unsigned 32-bit integers,
+    where bit `idx & 31` of word `idx >> 5` is set for document `idx`; i.e. bit `idx & 7` of byte `idx >> 3`.
+    """
+
+    __slots__ = ('bits', 'total')
+
+    def __init__(self, bits: npt.NDArray[np.uint8], total: int | None = None):
+        # Masks sent by clients may be shorter than `total`, so zero-pad to cover all documents (and to full words)
+        n_bytes = max(((len(bits) + 3) >> 2) << 2, 0 if total is None else self.n_bytes(total))
+        if n_bytes != len(bits):
+            bits = np.concatenate([bits, np.zeros(n_bytes - len(bits), dtype=np.uint8)])
+        self.bits = bits
+        self.total = len(bits) * 8 if total is None else total
+
+    @staticmethod
+    def n_bytes(total: int) -> int:
+        return ((total + 31) >> 5) * 4
+
+    @classmethod
+    def empty(cls, total: int) -> 'Bitmask':
+        return cls(np.zeros(cls.n_bytes(total), dtype=np.uint8), total)
+
+    @classmethod
+    def full(cls, total: int) -> 'Bitmask':
+        return ~cls.empty(total)
+
+    @classmethod
+    def from_bool(cls, mask: npt.NDArray[np.bool_]) -> 'Bitmask':
+        return cls(np.packbits(mask, bitorder='little'), len(mask))
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int] | npt.NDArray[np.int64], total: int) -> 'Bitmask':
+        if not isinstance(ids, np.ndarray):
+            ids = np.fromiter(ids, dtype=np.int64)
+        # Negative ids would silently wrap around
+        if len(ids) > 0 and (ids.min() < 0 or ids.max() >= total):
+            raise ValueError(f'Document ids must be in [0, {total})')
+        mask = np.zeros(total, dtype=bool)
+        mask[ids] = True
+        return cls.from_bool(mask)
+
+    @classmethod
+    def from_bytes(cls, buffer: bytes | bytearray | memoryview, total: int | None = None) -> 'Bitmask':
+        return cls(np.frombuffer(buffer, dtype=np.uint8), total)
+
+    @classmethod
+    def from_base64(cls, data: str | bytes, total: int | None = None) -> 'Bitmask':
+        return cls.from_bytes(base64.b64decode(data), total)
+
+    def to_bool(self) -> npt.NDArray[np.bool_]:
+        return np.unpackbits(self.bits, count=self.total, bitorder='little').view(bool)
+
+    def to_bytes(self) -> bytes:
+        return self.bits.tobytes()
+
+    def to_base64(self) -> bytes:
+        return base64.b64encode(np.ascontiguousarray(self.bits).data)
+
+    def ids(self, limit: int | None = None) -> npt.NDArray[np.int64]:
+        """
+        Sorted ids of all set bits (or only the first `limit` of them).
+        """
+        if limit is None:
+            return np.flatnonzero(self.to_bool())
+        batches = []
+        remaining = limit
+        for batch in self.iter_batches():
+            if remaining <= 0:
+                break
+            batches.append(batch[:remaining])
+            remaining -= len(batch)
+        if len(batches) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(batches)
+
+    def iter_batches(self, chunk_bytes: int = 1 << 14) -> Generator[npt.NDArray[np.int64], None, None]:
+        """
+        Stream the ids of set bits in batches by unpacking `chunk_bytes` bytes at a time.
+        """
+        for start in range(0, len(self.bits), chunk_bytes):
+            chunk = self.bits[start : start + chunk_bytes]
+            if not chunk.any():
+                continue
+            ids = np.flatnonzero(np.unpackbits(chunk, bitorder='little')) + start * 8
+            yield ids[ids < self.total]
+
+    def iter_ids(self, chunk_bytes: int = 1 << 14) -> Generator[int, None, None]:
+        for batch in self.iter_batches(chunk_bytes):
+            yield from batch.tolist()
+
+    def contains(self, ids: npt.NDArray[np.int64]) -> npt.NDArray[np.bool_]:
+        """
+        Vectorised membership test for (valid) document ids.
+        """
+        found: npt.NDArray[np.bool_] = ((self.bits[ids >> 3] >> (ids & 7).astype(np.uint8)) & 1).astype(bool)
+        return found
+
+    def count(self) -> int:
+        # Masks sent by clients may have bits set beyond `total`, which are no documents
+        full = self.total >> 3
+        count = int(np.bitwise_count(self.bits[:full]).sum(dtype=np.int64))
+        if self.total & 7:
+            count += (int(self.bits[full]) & ((1 << (self.total & 7)) - 1)).bit_count()
+        return count
+
+    def _aligned(self, other: 'Bitmask') -> tuple[npt.NDArray[np.uint8], npt.NDArray[np.uint8], int]:
+        # Masks sent by clients may be shorter or longer than the dataset, so pad the shorter one
+        if len(self.bits) == len(other.bits):
+            return self.bits, other.bits, max(self.total, other.total)
+        size = max(len(self.bits), len(other.bits))
+        a = np.zeros(size, dtype=np.uint8)
+        b = np.zeros(size, dtype=np.uint8)
+        a[: len(self.bits)] = self.bits
+        b[: len(other.bits)] = other.bits
+        return a, b, max(self.total, other.total)
+
+    def __and__(self, other: 'Bitmask') -> 'Bitmask':
+        a, b, total = self._aligned(other)
+        return Bitmask(np.bitwise_and(a, b), total)
+
+    def __or__(self, other: 'Bitmask') -> 'Bitmask':
+        a, b, total = self._aligned(other)
+        return Bitmask(np.bitwise_or(a, b), total)
+
+    def __sub__(self, other: 'Bitmask') -> 'Bitmask':
+        a, b, total = self._aligned(other)
+        return Bitmask(np.bitwise_and(a, np.invert(b)), total)
+
+    def __invert__(self) -> 'Bitmask':
+        bits = np.invert(self.bits)
+        # clear the padding bits beyond `total`
+        tail = np.unpackbits(bits[self.total >> 3 :], bitorder='little')
+        tail[self.total & 7 :] = 0
+        bits[self.total >> 3 :] = np.packbits(tail, bitorder='little')
+        return Bitmask(bits, self.total)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Bitmask):
+            return NotImplemented
+        a, b, _ = self._aligned(other)
+        return bool(np.array_equal(a, b))
+
+    def __repr__(self) -> str:
+        return f'Bitmask(count={self.count()}, total={self.total})'
+
+    def to_roaring(self) -> bytes:
+        """
+        Serialise into the portable roaring bitmap format (array and bitmap containers only),
+        which is much smaller than the raw bits for sparse masks.
+        """
+        ids = self.ids()
+        keys, starts, cards = np.unique(ids >> 16, return_index=True, return_counts=True)
+        header = [struct.pack('<II', ROARING_COOKIE, len(keys))]
+        header += [struct.pack('<HH', key, card - 1) for key, card in zip(keys.tolist(), cards.tolist(), strict=True)]
+        containers = []
+        for start, card in zip(starts.tolist(), cards.tolist(), strict=True):
+            low = (ids[start : start + card] & 0xFFFF).astype('<u2')
+            if card <= ROARING_ARRAY_MAX:
+                containers.append(low.tobytes())
+            else:
+                bits = np.zeros(ROARING_CHUNK, dtype=bool)
+                bits[low] = True
+                containers.append(np.packbits(bits, bitorder='little').tobytes())
+        offset = 8 + 4 * len(keys) + 4 * len(keys)
+        offsets = []
+        for container in containers:
+            offsets.append(struct.pack('<I', offset))
+            offset += len(container)
+        return b''.join(header + offsets + containers)
+
+    def to_rle(self) -> bytes:
+        """
+        Run-length encoding: varint lengths of alternating runs of unset and set bits, starting with unset bits.
+        Very compact for masks with long contiguous ranges (e.g. year filters or dense selections).
+        """
+        mask = self.to_bool()
+        changes = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+        bounds = np.concatenate([[0], changes, [len(mask)]])
+        runs = np.diff(bounds)
+        if len(mask) > 0 and mask[0]:
+            runs = np.concatenate([[0], runs])
+        return encode_varints(runs)
+
+    @classmethod
+    def from_rle(cls, buffer: bytes | bytearray | memoryview, total: int) -> 'Bitmask':
+        runs = decode_varints(buffer)
+        # Check before expanding anything, so a few bytes can not make us allocate huge arrays
+        # (runs are at most `total` each, so their sum can not overflow)
+        if len(runs) > 0 and (runs.min() < 0 or runs.max() > total or runs.sum() > total):
+            raise ValueError(f'Run-length encoded mask does not fit {total} documents')
+        bounds = np.cumsum(runs)
+        # Odd runs are set: mark where each of them starts and ends, everything in between is set
+        ends = bounds[1::2]
+        starts = ends - runs[1::2]
+        edges = np.bincount(starts, minlength=total + 1) - np.bincount(ends, minlength=total + 1)
+        return cls.from_bool(np.cumsum(edges[:total]) > 0)
+
+    def to_delta_varints(self) -> bytes:
+        """
+        Ids of set bits as varint-encoded gaps (first id, then differences to the previous one).
+        """
+        return encode_varints(np.diff(self.ids(), prepend=0))
+
+    @staticmethod
+    def ids_from_delta_varints(buffer: bytes | bytearray | memoryview) -> npt.NDArray[np.int64]:
+        return np.cumsum(decode_varints(buffer))
+
+    @classmethod
+    def from_roaring(cls, buffer: bytes | bytearray | memoryview, total: int) -> 'Bitmask':
+        if len(buffer) < 8:
+            raise ValueError('Truncated roaring bitmap')
+        cookie, n_containers = struct.unpack_from('<II', buffer, 0)
+        if cookie != ROARING_COOKIE:
+            raise ValueError('Unsupported roaring bitmap format (run containers are not supported)')
+        if 8 + 8 * n_containers > len(buffer):
+            raise ValueError('Truncated roaring bitmap')
+        descriptions = np.frombuffer(buffer, dtype='<u2', count=2 * n_containers, offset=8).reshape(-1, 2)
+        offsets = np.frombuffer(buffer, dtype='<u4', count=n_containers, offset=8 + 4 * n_containers)
+        mask = np.zeros(total, dtype=bool)
+        for (key, card_1), offset in zip(descriptions.tolist(), offsets.tolist(), strict=True):
+            base = key << 16
+            is_array = card_1 + 1 <= ROARING_ARRAY_MAX
+            if offset + (2 * (card_1 + 1) if is_array else ROARING_CHUNK >> 3) > len(buffer):
+                raise ValueError('Truncated roaring bitmap')
+            if is_array:
+                low = np.frombuffer(buffer, dtype='<u2', count=card_1 + 1, offset=offset).astype(np.int64)
+            else:
+                low = np.flatnonzero(np.unpackbits(np.frombuffer(buffer, dtype=np.uint8, count=ROARING_CHUNK >> 3, offset=offset), bitorder='little'))
+            if len(low) > 0 and base + int(low.max()) >= total:
+                raise ValueError(f'Roaring bitmap does not fit {total} documents')
+            mask[base + low] = True
+        return cls.from_bool(mask)
+
+
+__all__ = ['Bitmask', 'encode_varints', 'decode_varints']
@@ -1,7 +1,11 @@
+import asyncio
 import logging
+import tempfile
 from functools import wraps
 from inspect import Parameter, Signature, isawaitable, iscoroutinefunction
+from pathlib import Path
 from typing import (
+    Any,
     Awaitable,
     Callable,
     List,
@@ -21,16 +25,80 @@ from starlette.requests import Request
 from starlette.responses import Response
 from starlette.status import HTTP_304_NOT_MODIFIED
 
-from .backends import InMemoryBackend
+from .backends import Backend, InMemoryBackend, RESPBackend, SQLiteBackend
+from ..config import settings
 from .coders import Coder, JsonCoder
 from .key_builders import KeyBuilder, default_key_builder
+from ..util import content_etag, etag_matches
 
 logger: logging.Logger = logging.getLogger('cache')
 logger.addHandler(logging.NullHandler())
 P = ParamSpec('P')
 R = TypeVar('R')
 
-memory = InMemoryBackend()
+
+def _backend(name: str, limit: int) -> Backend:
+    if settings.CACHE_BACKEND == 'sqlite':
+        path = Path(settings.CACHE_FILE) if settings.CACHE_FILE else Path(tempfile.gettempdir()) / 'lithub-cache.sqlite'
+        return SQLiteBackend(path, name=name, limit=limit)
+    if settings.CACHE_BACKEND == 'resp':
+        return RESPBackend(settings.CACHE_URL, prefix=f'lithub:{name}:')
+    return InMemoryBackend(limit=limit)
+
+
+# Full-text search results are requested as users type, so keep them apart from (and unable to evict) everything else.
+# Their share is taken out of CACHE_LIMIT, so both together never hold more than that.
+_search_limit = min(settings.SEARCH_CACHE_LIMIT, settings.CACHE_LIMIT)
+memory = _backend('cache', settings.CACHE_LIMIT - _search_limit)
+search_memory = _backend('search', _search_limit)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same thing (per key, within this process):
+    the first caller (leader) runs it, everyone else awaits the leader's result (or error).
+    """
+
+    def __init__(self, timeout: float | None = None):
+        self.timeout = timeout  # seconds followers wait for the leader before computing themselves (None to wait forever)
+        self._calls: dict[str, asyncio.Future[Any]] = {}
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[R]]) -> R:
+        future = self._calls.get(key)
+        if future is not None:
+            try:
+                return cast(R, await asyncio.wait_for(asyncio.shield(future), self.timeout))
+            except TimeoutError:
+                logger.warning(f"Gave up waiting for concurrent computation of '{key}' after {self.timeout}s")
+                return await fn()
+            except asyncio.CancelledError:
+                task = asyncio.current_task()
+                if future.cancelled() and (task is None or task.cancelling() == 0):
+                    # The leader was cancelled (e.g. its client went away), but we are still needed
+                    return await fn()
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved, there may be no followers
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+in_flight = SingleFlight(timeout=settings.CACHE_SINGLE_FLIGHT_TIMEOUT)
 
 
 def _augment_signature(signature: Signature, *extra: Parameter) -> Signature:
@@ -74,6 +142,26 @@ def _uncacheable(request: Optional[Request]) -> bool:
     return request.headers.get('Cache-Control') in ('no-store', 'no-cache')
 
 
+def _not_modified(request: Optional[Request], response: Response, content: bytes, max_age: Optional[int], status: str) -> bool:
+    """Set caching headers (the ETag is derived from the content, so it is the same in every worker)
+
+    Returns true (and turns the response into a 304) if the client already has this content.
+
+    """
+    etag = content_etag(content)
+    response.headers.update(
+        {
+            'Cache-Control': 'no-cache' if max_age is None else f'max-age={max_age}',
+            'ETag': etag,
+            'X-API-Cache': status,
+        }
+    )
+    if request is not None and etag_matches(request.headers.get('if-none-match'), etag):
+        response.status_code = HTTP_304_NOT_MODIFIED
+        return True
+    return False
+
+
 def cache(
     expire: Optional[int] = None,
     coder: Optional[Type[Coder]] = None,
@@ -143,16 +231,14 @@ def cache(
             if _uncacheable(request):
                 return await ensure_async_func(*args, **kwargs)
 
-            prefix = 'api'
             coder_instance = (coder or JsonCoder)()
             expire = expire
             key_builder = key_builder or default_key_builder
             backend = memory
-            cache_status_header = 'X-API-Cache'
 
             cache_key = key_builder(
                 func,
-                f'{prefix}:{namespace}',
+                namespace,
                 request=request,
                 response=response,
                 args=args,
@@ -172,41 +258,30 @@ def cache(
                 ttl, cached = 0, None
 
             if cached is None:  # cache miss
-                result = await ensure_async_func(*args, **kwargs)
-                to_cache = coder_instance.encode(result)
 
-                try:
-                    await backend.set(cache_key, to_cache, expire)
-                except Exception:
-                    logger.warning(
-                        f"Error setting cache key '{cache_key}' in backend:",
-                        exc_info=True,
-                    )
-
-                if response:
-                    response.headers.update(
-                        {
-                            'Cache-Control': f'max-age={expire}',
-                            'ETag': f'W/{hash(to_cache)}',
-                            cache_status_header: 'MISS',
-                        }
-                    )
+                async def compute() -> tuple[R, bytes]:
+                    result = await ensure_async_func(*args, **kwargs)
+                    to_cache = coder_instance.encode(result)
+
+                    try:
+                        await backend.set(cache_key, to_cache, expire)
+                    except Exception:
+                        logger.warning(
+                            f"Error setting cache key '{cache_key}' in backend:",
+                            exc_info=True,
+                        )
+                    return result, to_cache
+
+                # Identical concurrent requests (e.g. right after a restart) wait for the first one instead of all computing it
+                result, to_cache = await in_flight.run(cache_key, compute)
+
+                # The client may have gotten the same content from another worker (or before a restart)
+                if response and _not_modified(request, response, to_cache, expire, 'MISS'):
+                    return response
 
             else:  # cache hit
-                if response:
-                    etag = f'W/{hash(cached)}'
-                    response.headers.update(
-                        {
-                            'Cache-Control': f'max-age={ttl}',
-                            'ETag': etag,
-                            cache_status_header: 'HIT',
-                        }
-                    )
-
-                    if_none_match = request and request.headers.get('if-none-match')
-                    if if_none_match == etag:
-                        response.status_code = HTTP_304_NOT_MODIFIED
-                        return response
+                if response and _not_modified(request, response, cached, ttl, 'HIT'):
+                    return response
                 try:
                     result = cast(R, coder_instance.decode_as_type(cached, type_=return_type))
                 except:
@@ -221,4 +296,4 @@ def cache(
     return wrapper
 
 
-__all__ = ['cache']
+__all__ = ['cache', 'memory', 'search_memory', 'SingleFlight', 'in_flight']
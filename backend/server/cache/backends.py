@@ -1,12 +1,21 @@
 import abc
+import asyncio
+import sqlite3
+import threading
 import time
 from asyncio import Lock
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+from urllib.parse import urlparse
 
 from ..logging import get_logger
 from ..config import settings
 
 logger = get_logger('cache.backend')
+R = TypeVar('R')
 
 
 @dataclass
@@ -14,6 +23,7 @@ class Value:
     data: bytes
     ttl_ts: int | None
     ts: int
+    quota: str | None = None  # key prefix whose quota this entry counts against
 
 
 class Backend(abc.ABC):
@@ -35,20 +45,45 @@ class Backend(abc.ABC):
 
 
 class InMemoryBackend(Backend):
-    _store: dict[str, Value] = {}
-    _size: int = 0
-    _lock = Lock()
+    """
+    Per-process cache with least-recently-used eviction; get, set, and evict are O(1).
+
+    Besides the overall `limit`, entries whose keys start with one of the prefixes in `quotas`
+    are limited to that many bytes (e.g. to keep one dataset or endpoint from evicting everything else).
+    """
+
+    # Seconds between sweeps for expired entries (which would otherwise only be dropped when requested or evicted)
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, limit: int | None = None, quotas: dict[str, int] | None = None):
+        # Entries in order of use, least recently used first
+        self._store: OrderedDict[str, Value] = OrderedDict()
+        self._size: int = 0
+        self._lock = Lock()
+        self.limit = settings.CACHE_LIMIT if limit is None else limit  # maximum size of all cached values in bytes
+        self.quotas = settings.CACHE_QUOTAS if quotas is None else quotas  # maximum size per key prefix in bytes
+        # Entries per quota in order of use and their total size
+        self._quota_entries: dict[str, OrderedDict[str, None]] = {prefix: OrderedDict() for prefix in self.quotas}
+        self._quota_sizes: dict[str, int] = dict.fromkeys(self.quotas, 0)
+        self._last_sweep = self._now
 
     @property
     def _now(self) -> int:
         return int(time.time())
 
+    def _quota(self, key: str) -> str | None:
+        # Longest matching prefix, so more specific quotas take precedence
+        return max((prefix for prefix in self.quotas if key.startswith(prefix)), key=len, default=None)
+
     def _get(self, key: str) -> Value | None:
         v = self._store.get(key)
         if v:
             if v.ttl_ts is not None and v.ttl_ts < self._now:
-                del self._store[key]
+                self._delete(key)
             else:
+                self._store.move_to_end(key)
+                if v.quota is not None:
+                    self._quota_entries[v.quota].move_to_end(key)
                 return v
         return None
 
@@ -68,34 +103,291 @@ class InMemoryBackend(Backend):
                 return v.data
             return None
 
-    def _ensure_capacity(self, new_value: bytes) -> None:
-        headroom = settings.CACHE_LIMIT - self._size - len(new_value)
-        if headroom < 0:
-            logger.info(f'Cache is full, overhead is {headroom}')
-            # sort by age and keep deleting the oldest entries until enough space is there
-            for key in sorted(self._store.keys(), key=lambda k: self._store[k].ts):
-                headroom += len(self._store[key].data)
-                del self._store[key]
-                logger.info(f'Dropping cache entry to make space: {key}')
+    def _delete(self, key: str) -> None:
+        v = self._store.pop(key)
+        self._size -= len(v.data)
+        if v.quota is not None:
+            del self._quota_entries[v.quota][key]
+            self._quota_sizes[v.quota] -= len(v.data)
 
-                # we now have enough space again, stop here
-                if headroom >= 0:
-                    break
+    def _evict(self, quota: str | None) -> None:
+        if quota is not None:
+            entries = self._quota_entries[quota]
+            while self._quota_sizes[quota] > self.quotas[quota]:
+                self._delete(next(iter(entries)))
+        if self._size > self.limit:
+            logger.debug(f'Cache is full, overhead is {self._size - self.limit}')
+            while self._size > self.limit:
+                self._delete(next(iter(self._store)))
+
+    def _sweep(self) -> None:
+        now = self._now
+        self._last_sweep = now
+        expired = [key for key, v in self._store.items() if v.ttl_ts is not None and v.ttl_ts < now]
+        for key in expired:
+            self._delete(key)
+        if len(expired) > 0:
+            logger.debug(f'Dropped {len(expired)} expired cache entries')
 
     async def set(self, key: str, value: bytes, expire: int | None = None) -> None:
         async with self._lock:
-            self._ensure_capacity(value)
-            self._store[key] = Value(data=value, ttl_ts=None if expire is None else self._now + expire, ts=self._now)
+            if key in self._store:
+                self._delete(key)
+            quota = self._quota(key)
+            if len(value) > (self.limit if quota is None else min(self.limit, self.quotas[quota])):
+                logger.debug(f'Not caching {key}, {len(value):,} bytes exceed the cache size')
+                return
+            self._store[key] = Value(data=value, ttl_ts=None if expire is None else self._now + expire, ts=self._now, quota=quota)
+            self._size += len(value)
+            if quota is not None:
+                self._quota_entries[quota][key] = None
+                self._quota_sizes[quota] += len(value)
+            if self._now - self._last_sweep >= self.SWEEP_INTERVAL:
+                self._sweep()
+            self._evict(quota)
 
     async def clear(self, namespace: str | None = None, key: str | None = None) -> int:
         count = 0
-        if namespace:
-            keys = list(self._store.keys())
-            for key in keys:
-                if key.startswith(namespace):
-                    del self._store[key]
-                    count += 1
-        elif key:
-            del self._store[key]
-            count += 1
+        async with self._lock:
+            if namespace:
+                keys = list(self._store.keys())
+                for key in keys:
+                    if key.startswith(namespace):
+                        self._delete(key)
+                        count += 1
+            elif key and key in self._store:
+                self._delete(key)
+                count += 1
         return count
+
+
+class SQLiteBackend(Backend):
+    """
+    Cache shared by all workers on this machine, stored in a (memory-mapped) SQLite file.
+
+    Each backend keeps its entries in its own table (`name`), whose total size is tracked by triggers,
+    so the `limit` holds across all workers. When full, the oldest entries are evicted first.
+    """
+
+    def __init__(self, path: Path, name: str = 'cache', limit: int | None = None):
+        self.path = path
+        self.name = name
+        self.limit = settings.CACHE_LIMIT if limit is None else limit  # maximum size of all cached values in bytes
+        self._local = threading.local()
+        # Separate from the database executor, so a busy (locked) cache file can not hold up queries
+        self._executor = ThreadPoolExecutor(max_workers=settings.CACHE_EXECUTOR_WORKERS, thread_name_prefix=f'lithub-cache-{name}')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = self._connect()
+        try:
+            con.executescript(f"""
+                CREATE TABLE IF NOT EXISTS "{name}" (key TEXT PRIMARY KEY, data BLOB NOT NULL, expires INTEGER, ts INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS "ix_{name}_ts" ON "{name}" (ts);
+                CREATE TABLE IF NOT EXISTS cache_sizes (name TEXT PRIMARY KEY, size INTEGER NOT NULL);
+                INSERT OR IGNORE INTO cache_sizes (name, size) VALUES ('{name}', 0);
+                CREATE TRIGGER IF NOT EXISTS "{name}_insert" AFTER INSERT ON "{name}" BEGIN
+                    UPDATE cache_sizes SET size = size + length(NEW.data) WHERE name = '{name}';
+                END;
+                CREATE TRIGGER IF NOT EXISTS "{name}_delete" AFTER DELETE ON "{name}" BEGIN
+                    UPDATE cache_sizes SET size = size - length(OLD.data) WHERE name = '{name}';
+                END;
+            """)
+        finally:
+            con.close()
+
+    async def _run(self, fn: Callable[..., R], *args: Any) -> R:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        con.execute('PRAGMA journal_mode = WAL;')
+        # Losing the most recent entries on a power cut is fine for a cache
+        con.execute('PRAGMA synchronous = OFF;')
+        con.execute(f'PRAGMA mmap_size = {int(self.limit) * 2};')
+        return con
+
+    @property
+    def _con(self) -> sqlite3.Connection:
+        # One connection per thread, so concurrent operations are only serialised by SQLite itself
+        con: sqlite3.Connection | None = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = self._connect()
+        return con
+
+    @property
+    def _now(self) -> int:
+        return int(time.time())
+
+    def _get(self, key: str) -> tuple[int | None, bytes | None]:
+        row = self._con.execute(
+            f'SELECT data, expires FROM "{self.name}" WHERE key = ? AND (expires IS NULL OR expires >= ?);',
+            (key, self._now),
+        ).fetchone()
+        if row is None:
+            return 0, None
+        return (None if row[1] is None else row[1] - self._now), row[0]
+
+    async def get_with_ttl(self, key: str) -> tuple[int | None, bytes | None]:
+        return await self._run(self._get, key)
+
+    async def get(self, key: str) -> bytes | None:
+        return (await self._run(self._get, key))[1]
+
+    def _set(self, key: str, value: bytes, expire: int | None) -> None:
+        now = self._now
+        con = self._con
+        if len(value) > self.limit:
+            logger.debug(f'Not caching {key}, {len(value):,} bytes exceed the cache size')
+            with con:
+                con.execute(f'DELETE FROM "{self.name}" WHERE key = ?;', (key,))
+            return
+        with con:
+            con.execute('BEGIN IMMEDIATE;')
+            con.execute(f'DELETE FROM "{self.name}" WHERE key = ? OR expires < ?;', (key, now))
+            con.execute(f'INSERT INTO "{self.name}" (key, data, expires, ts) VALUES (?, ?, ?, ?);', (key, value, None if expire is None else now + expire, now))
+            excess = con.execute('SELECT size FROM cache_sizes WHERE name = ?;', (self.name,)).fetchone()[0] - self.limit
+            if excess > 0:
+                logger.info(f'Cache {self.name} is full, overhead is {excess}')
+                # Drop the oldest entries until there is enough space again
+                drop = []
+                for old_key, size in con.execute(f'SELECT key, length(data) FROM "{self.name}" WHERE key != ? ORDER BY ts;', (key,)):
+                    drop.append(old_key)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                con.executemany(f'DELETE FROM "{self.name}" WHERE key = ?;', [(k,) for k in drop])
+
+    async def set(self, key: str, value: bytes, expire: int | None = None) -> None:
+        await self._run(self._set, key, value, expire)
+
+    def _clear(self, namespace: str | None, key: str | None) -> int:
+        with self._con as con:
+            if namespace:
+                # Compare prefixes literally (`LIKE` has wildcards and is case-insensitive)
+                return con.execute(f'DELETE FROM "{self.name}" WHERE substr(key, 1, length(?1)) = ?1;', (namespace,)).rowcount
+            if key:
+                return con.execute(f'DELETE FROM "{self.name}" WHERE key = ?;', (key,)).rowcount
+        return 0
+
+    async def clear(self, namespace: str | None = None, key: str | None = None) -> int:
+        return await self._run(self._clear, namespace, key)
+
+
+class RESPError(Exception):
+    pass
+
+
+class RESPBackend(Backend):
+    """
+    Cache shared by all workers (and machines) in a server speaking the Redis protocol (RESP), e.g. Redis or Valkey.
+
+    Keys are prefixed with `prefix`, so several backends can share a server. The size limit is not enforced here,
+    configure the server accordingly instead (e.g. `maxmemory` with `maxmemory-policy allkeys-lru`).
+    """
+
+    def __init__(self, url: str, prefix: str = 'lithub:cache:'):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip('/') or 0)
+        self.password = parsed.password
+        self.prefix = prefix
+        self._lock = Lock()
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    @staticmethod
+    def _encode(*args: str | bytes | int) -> bytes:
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts += [f'${len(data)}\r\n'.encode(), data, b'\r\n']
+        return b''.join(parts)
+
+    async def _read(self) -> Any:
+        assert self._reader is not None
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RESPError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            if int(rest) < 0:
+                return None
+            return (await self._reader.readexactly(int(rest) + 2))[:-2]
+        if kind == b'*':
+            if int(rest) < 0:
+                return None
+            return [await self._read() for _ in range(int(rest))]
+        raise RESPError(f'Unexpected reply: {line!r}')
+
+    async def _execute(self, *commands: tuple[str | bytes | int, ...]) -> list[Any]:
+        """
+        Send all `commands` at once (pipelined) and return their replies.
+        """
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                    setup = ([('AUTH', self.password)] if self.password else []) + ([('SELECT', self.db)] if self.db else [])
+                    for command in setup:
+                        self._writer.write(self._encode(*command))
+                        await self._writer.drain()
+                        await self._read()
+                self._writer.write(b''.join(self._encode(*command) for command in commands))
+                await self._writer.drain()
+                replies: list[Any] = []
+                error: RESPError | None = None
+                for _ in commands:
+                    try:
+                        replies.append(await self._read())
+                    except RESPError as e:
+                        # Keep reading, so the replies of later commands don't end up with the next caller
+                        error = error or e
+            except BaseException:
+                # Interrupted (connection lost, cancelled, ...) with replies possibly left unread on the socket,
+                # which would otherwise be read by the next caller: reconnect on the next call
+                if self._writer is not None:
+                    self._writer.close()
+                self._reader, self._writer = None, None
+                raise
+            if error is not None:
+                raise error
+            return replies
+
+    async def get_with_ttl(self, key: str) -> tuple[int | None, bytes | None]:
+        ttl, data = await self._execute(('PTTL', self.prefix + key), ('GET', self.prefix + key))
+        if data is None:
+            return 0, None
+        return (None if ttl < 0 else ttl // 1000), data
+
+    async def get(self, key: str) -> bytes | None:
+        (data,) = await self._execute(('GET', self.prefix + key))
+        return data  # type: ignore[no-any-return]
+
+    async def set(self, key: str, value: bytes, expire: int | None = None) -> None:
+        command: tuple[str | bytes | int, ...] = ('SET', self.prefix + key, value)
+        if expire is not None:
+            command += ('EX', max(int(expire), 1))
+        await self._execute(command)
+
+    async def clear(self, namespace: str | None = None, key: str | None = None) -> int:
+        if namespace:
+            # Escape glob characters, so the namespace is matched literally
+            pattern = ''.join(f'\\{c}' if c in '*?[]\\' else c for c in self.prefix + namespace) + '*'
+            count, cursor = 0, b'0'
+            while True:
+                ((cursor, keys),) = await self._execute(('SCAN', cursor, 'MATCH', pattern, 'COUNT', 1000))
+                if keys:
+                    (deleted,) = await self._execute(('DEL', *keys))
+                    count += deleted
+                if cursor == b'0':
+                    return count
+        if key:
+            (deleted,) = await self._execute(('DEL', self.prefix + key))
+            return deleted  # type: ignore[no-any-return]
+        return 0
@@ -1,6 +1,5 @@
 import datetime
 import json
-import logging
 import pickle  # nosec:B403
 from decimal import Decimal
 from typing import (
@@ -14,8 +13,7 @@ from typing import (
 )
 
 from fastapi.encoders import jsonable_encoder
-from pydantic import BaseConfig, ValidationError, fields
-from pydantic_core import core_schema
+from pydantic import TypeAdapter
 from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.templating import _TemplateResponse as TemplateResponse
 
@@ -54,12 +52,12 @@ class Coder:
     def decode(cls, value: bytes) -> Any:
         raise NotImplementedError
 
-    # (Shared) cache for endpoint return types to Pydantic model fields.
+    # (Shared) cache for endpoint return types to Pydantic type adapters.
     # Note that subclasses share this cache! If a subclass overrides the
-    # decode_as_type method and then stores a different kind of field for a
+    # decode_as_type method and then stores a different kind of adapter for a
     # given type, do make sure that the subclass provides its own class
     # attribute for this cache.
-    _type_field_cache: ClassVar[Dict[Any, fields.Field]] = {}  # type: ignore[valid-type]
+    _type_adapter_cache: ClassVar[Dict[Any, TypeAdapter[Any]]] = {}
 
     @overload
     @classmethod
@@ -78,16 +76,10 @@ class Coder:
         """
         result = cls.decode(value)
         if type_ is not None:
-            try:
-                field = cls._type_field_cache[type_]
-            except KeyError as e:
-                logging.debug(f'decode_as_type KeyError: {e}')
-                field = cls._type_field_cache[type_] = core_schema.ModelField(name='body', type_=type_, class_validators=None, model_config=BaseConfig)  # type: ignore[typeddict-item,typeddict-unknown-key]
-            result, errors = field.validate(result, {}, loc=())  # type: ignore[attr-defined]
-            if errors is not None:
-                if not isinstance(errors, list):
-                    errors = [errors]
-                raise ValidationError(errors, type_)
+            adapter = cls._type_adapter_cache.get(type_)
+            if adapter is None:
+                adapter = cls._type_adapter_cache[type_] = TypeAdapter(type_)
+            result = adapter.validate_python(result)
         return result
 
 
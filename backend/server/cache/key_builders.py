@@ -1,6 +1,9 @@
 import hashlib
+import json
+from enum import Enum
 from typing import Any, Callable, Dict, Optional, Tuple, Protocol, Union, Awaitable
 
+from pydantic import BaseModel
 from starlette.requests import Request
 from starlette.responses import Response
 
@@ -20,6 +23,19 @@ class KeyBuilder(Protocol):
     ) -> Union[Awaitable[str], str]: ...
 
 
+def _canonical(value: Any) -> Any:
+    # Datasets are identified by key and content version (not by object identity), see `Dataset.cache_namespace`
+    if (cache_namespace := getattr(value, 'cache_namespace', None)) is not None:
+        return cache_namespace
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json')
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f'Can not derive a cache key from {type(value).__name__}')
+
+
 def default_key_builder(
     func: Callable[..., Any],
     namespace: str = '',
@@ -29,7 +45,16 @@ def default_key_builder(
     args: Tuple[Any, ...],
     kwargs: Dict[str, Any],
 ) -> str:
-    cache_key = hashlib.md5(  # noqa: S324
-        f'{func.__module__}:{func.__name__}:{args}:{kwargs}'.encode()
-    ).hexdigest()
-    return f'{namespace}:{cache_key}'
+    """
+    Key derived from the endpoint and its (canonicalised) parameters only, so it is the same in every worker and after restarts.
+    Keys of endpoints with a dataset parameter start with its `cache_namespace`, so they are dropped with that dataset version.
+    """
+    params = json.dumps(
+        {'func': f'{func.__module__}:{func.__qualname__}', 'args': args, 'kwargs': kwargs},
+        default=_canonical,
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    digest = hashlib.blake2b(params.encode(), digest_size=16).hexdigest()
+    scope = next((v.cache_namespace for v in [*args, *kwargs.values()] if getattr(v, 'cache_namespace', None) is not None), 'api')
+    return f'{scope}:{namespace}:{digest}'
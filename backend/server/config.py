@@ -1,5 +1,6 @@
 import os
 import json
+from typing import Literal
 
 from pydantic import field_validator
 from pydantic_settings import BaseSettings
@@ -16,6 +17,12 @@ class Settings(BaseSettings):
     SERVE_STATIC: bool = False  # when using nginx for static file serving, set to False
     STATIC_FILES: str = './frontend/dist/'  # path to the static files to be served
     DATASETS_FOLDER: str = './data/'
+    DATASETS_LOAD_WORKERS: int = 8  # number of datasets discovered (and warmed up) in parallel
+    DATASETS_WARMUP: bool = True  # load scores, bitmaps, and search terms in the background after startup
+    DATASETS_WATCH_INTERVAL: float | None = None  # seconds between checks of DATASETS_FOLDER for changes to reload (disabled if not set)
+    ADMIN_TOKEN: str | None = None  # bearer token for the /api/admin endpoints (disabled if not set)
+    DATASETS_RELOAD_CHECK_INTERVAL: float = 5.0  # seconds between checks for reloads requested via /api/admin/reload (if not watching)
+    SIDECAR_FOLDER: str | None = None  # where to put derived files (e.g. label score matrices); defaults to the dataset folder
 
     OPENAPI_FILE: str = '/openapi.json'  # absolute URL path to openapi.json file
     OPENAPI_PREFIX: str = ''  # see https://fastapi.tiangolo.com/advanced/behind-a-proxy/
@@ -26,7 +33,34 @@ class Settings(BaseSettings):
     CORS_ORIGINS: list[str] = []  # list of trusted hosts
 
     CACHE_LIMIT: int = 1024 * 1024 * 128  # Maximum cache size is 128MB
-    DOWNLOAD_BUFFER: int = 10240
+    CACHE_QUOTAS: dict[str, int] = {}  # maximum bytes of in-memory cache entries per key prefix (e.g. {"api:healthmap:": 33554432})
+    CACHE_BACKEND: Literal['memory', 'sqlite', 'resp'] = 'memory'  # 'sqlite' and 'resp' share the cache between workers
+    CACHE_FILE: str | None = None  # SQLite file for the 'sqlite' cache backend; defaults to a file in the system's temp dir
+    CACHE_EXECUTOR_WORKERS: int = 4  # number of threads per 'sqlite' cache backend (separate from the database executor)
+    CACHE_URL: str = 'redis://localhost:6379/0'  # server for the 'resp' cache backend (anything speaking the Redis protocol)
+    CACHE_SINGLE_FLIGHT_TIMEOUT: float | None = 30.0  # seconds identical concurrent requests wait for the first one before computing themselves
+    SEARCH_CACHE_LIMIT: int = 1024 * 1024 * 32  # part of CACHE_LIMIT reserved for full-text search results (32MB)
+    SEARCH_CACHE_EXPIRE: int | None = 60 * 60  # seconds to keep full-text search results in the cache
+    CUBE_CACHE_EXPIRE: int | None = 60 * 60  # seconds to keep label/group x year counts in the cache
+    SUGGEST_MIN_DOCS: int = 2  # only suggest terms appearing in at least this many documents (keeps the vocabulary small)
+    DOWNLOAD_BUFFER: int = 10240  # number of rows fetched and encoded at a time for downloads
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024  # send downloads in chunks of (at least) this many bytes
+    DOWNLOAD_MAX_CONCURRENT: int = 4  # maximum number of concurrent downloads per worker
+    EXPORT_FOLDER: str | None = None  # where to keep results of export jobs; defaults to a folder in the system's temp dir
+    EXPORT_MAX_JOBS: int = 2  # maximum number of export jobs running at once per worker (others are queued)
+    EXPORT_MAX_AGE: int = 60 * 60 * 24  # seconds to keep finished exports
+
+    MASK_MAX_NODES: int = 512  # maximum number of nodes in a mask expression tree
+    MASK_CACHE_EXPIRE: int | None = None  # seconds to keep evaluated (sub-)expressions in the cache
+    ORDER_CACHE_SIZE: int = 64  # number of relevance sort orders (per label/group combination) to keep in memory
+
+    DB_POOL_SIZE: int = 8  # maximum number of open SQLite connections per dataset
+    DB_POOL_TIMEOUT: float = 10.0  # seconds to wait for a free connection before giving up
+    DB_IMMUTABLE: bool = True  # open databases as immutable (do not replace files in-place while the server runs!)
+    DB_MMAP_SIZE: int = 1024 * 1024 * 1024  # bytes of each database to memory-map (1GB)
+    DB_CACHE_SIZE: int = -1024 * 64  # SQLite page cache per connection (negative values are in KiB, so 64MB)
+    DB_EXECUTOR_WORKERS: int = 16  # number of threads running database queries off the event loop
+    DB_QUERY_TIMEOUT: float = 30.0  # seconds after which a query is interrupted (0 to disable)
 
     MAILING_ENABLED: bool = False
     MAILING_SENDER: str | None = 'Literature Hub <noreply@climateliterature.org>'
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+import pyarrow as pa
+from pydantic import BaseModel
+
+from .scores import LabelScores
+
+# Number of documents processed at a time (bounds the size of temporary arrays)
+CHUNK_SIZE = 1 << 16
+
+
+class Cube(BaseModel):
+    min_score: float
+    years: list[int]
+    labels: dict[str, list[int]]  # per label, number of documents per year in `years`
+    groups: dict[str, list[int]]  # per group, number of documents per year in `years`
+
+
+def load_cube(source: Path) -> dict[float, Cube]:
+    """
+    Read the cube written by `lithub.export.writers.write_cube`, one `Cube` per threshold.
+    """
+    with pa.memory_map(source.as_posix(), 'r') as f:
+        table = pa.ipc.open_file(f).read_all()
+
+    cubes: dict[float, Cube] = {}
+    for kind, key, threshold, year, count in zip(*(table.column(c).to_pylist() for c in ('kind', 'key', 'threshold', 'year', 'count')), strict=True):
+        cube = cubes.setdefault(threshold, Cube(min_score=threshold, years=[], labels={}, groups={}))
+        target = cube.labels if kind == 'label' else cube.groups
+        counts = target.setdefault(key, [])
+        if len(counts) == len(cube.years):
+            # Rows come in blocks of all years per key, so the first key of each threshold defines the year range
+            cube.years.append(year)
+        counts.append(count)
+    return cubes
+
+
+def cube_from_scores(scores: LabelScores, years: npt.NDArray[np.int16], groups: dict[str, list[str]], min_score: float) -> Cube:
+    """
+    Compute the cube on the fly from the score matrix and publication years (for datasets exported without one).
+    `groups` maps group keys to all their labels (incl. those of subgroups).
+    """
+    years = np.asarray(years)
+    known = years[years > 0]
+    first_year, last_year = (int(known.min()), int(known.max())) if len(known) > 0 else (0, -1)
+    n_years = last_year - first_year + 1
+
+    group_rows = {
+        key: [scores.index[label] for label in labels] for key, labels in groups.items() if len(labels) > 0 and all(label in scores for label in labels)
+    }
+    label_counts = np.zeros((len(scores.labels), n_years), dtype=np.int64)
+    group_counts = np.zeros((len(group_rows), n_years), dtype=np.int64)
+
+    for start in range(0, scores.total, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, scores.total)
+        chunk_years = years[start:end]
+        has_year = chunk_years > 0
+        year_idx = chunk_years[has_year].astype(np.intp) - first_year
+        # Compare in float64 to get exactly the same results as SQLite does
+        passed = np.greater_equal(scores.scores[:, start:end][:, has_year], np.float64(min_score))
+        for i, row in enumerate(passed):
+            label_counts[i] += np.bincount(year_idx[row], minlength=n_years)
+        for i, rows in enumerate(group_rows.values()):
+            group_counts[i] += np.bincount(year_idx[passed[rows].any(axis=0)], minlength=n_years)
+
+    return Cube(
+        min_score=min_score,
+        years=list(range(first_year, last_year + 1)),
+        labels={label: counts for label, counts in zip(scores.labels, label_counts.tolist(), strict=True)},
+        groups={key: counts for key, counts in zip(group_rows.keys(), group_counts.tolist(), strict=True)},
+    )
+
+
+__all__ = ['Cube', 'load_cube', 'cube_from_scores']
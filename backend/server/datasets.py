@@ -1,29 +1,78 @@
+import asyncio
+import hashlib
 import json
 import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncGenerator, Callable, Generator, Iterator, TypeVar
 
-from pydantic import ValidationError
+import numpy as np
+import numpy.typing as npt
+from pydantic import BaseModel, ValidationError
 
-from lithub.models import Document, DatasetInfoFull, DatasetInfoWeb, SchemeGroup
+from lithub.models import Document, DatasetInfoFull, DatasetInfoWeb, DatasetManifest, ManifestFile, SchemeGroup
+from lithub.util.bitmaps import BitmapFile
 from .logging import get_logger
+from .cache import memory, search_memory
 from .config import settings
+from .cube import Cube, cube_from_scores, load_cube
+from .db import ConnectionPool, run_in_executor
+from .ordering import sort_order
+from .scores import LabelScores, load_sidecar, load_years
+from .util import Payload
+from .vocabulary import Vocabulary
 
 logger = get_logger('util.datasets')
 
+R = TypeVar('R')
+
 
 class Dataset:
-    def __init__(self, info: DatasetInfoFull, path: Path, key: str):
+    def __init__(self, info: DatasetInfoFull, path: Path, key: str, manifest: DatasetManifest | None = None):
         self.key = key
         self.full_info = info
+        self.path = path
         self.db_file = path / info.db_filename
+        self.sidecar_path = Path(settings.SIDECAR_FOLDER) / key if settings.SIDECAR_FOLDER else path
         self.logger = get_logger(f'util.db.{key}')
+        self.pool = ConnectionPool(self.db_file, name=key)
+        # Identifies the meta-data this dataset was loaded from (see `DatasetCache.reload`)
+        manifest_json = manifest.model_dump_json() if manifest is not None else ''
+        self.fingerprint = hashlib.blake2b(f'{info.model_dump_json()}:{manifest_json}'.encode(), digest_size=8).hexdigest()
         self._total: int | None = None
 
         self._groups: dict[str, SchemeGroup] | None = None
         self._columns: set[str] | None = None
         self._label_columns: set[str] | None = None
         self._document_columns: set[str] | None = None
+        self._search_columns: list[str] | None = None
+        self._search_id: str | None = None
+        self._vocabulary: Vocabulary | None = None
+        self._version: str | None = None
+        self._scores: LabelScores | None = None
+        self._bitmaps: BitmapFile | None = None
+        # Loads that failed are not retried (on every request) for this version of the dataset, see `DatasetCache.reload`
+        self._scores_failed = False
+        self._bitmaps_failed = False
+        self._years: npt.NDArray[np.int16] | None = None
+        self._cubes: dict[float, Cube] | None = None
+        self._info_payload: Payload | None = None
+        self._orders: OrderedDict[tuple[str, ...], npt.NDArray[np.integer]] = OrderedDict()
+        self._orders_lock = threading.Lock()
+        # Serialise expensive lazy loads, so concurrent first requests (or the warm-up) do not duplicate them
+        self._scores_lock = threading.Lock()
+        self._years_lock = threading.Lock()
+        self._bitmaps_lock = threading.Lock()
+        self._vocabulary_lock = threading.Lock()
+
+        if manifest is not None:
+            # Facts recorded at export time, so they do not need to be probed from the database
+            self._total = manifest.total
+            self._columns = set(manifest.columns)
+            self._version = manifest.files[info.db_filename].blake2b[:16]
 
     @property
     def groups(self) -> dict[str, SchemeGroup]:
@@ -57,13 +106,22 @@ class Dataset:
             },
         )
 
+    @property
+    def info_payload(self) -> Payload:
+        """
+        Serialised `info` (the same for the lifetime of this dataset version, see `DatasetCache.reload`).
+        """
+        if self._info_payload is None:
+            self._info_payload = Payload(self.info.model_dump_json().encode())
+        return self._info_payload
+
     @property
     def total(self) -> int:
         if self._total is None:
             try:
-                with self as db:
+                with self.cursor() as cur:
                     logger.debug(f'Loading size of dataset for {self.key}')
-                    rslt = db.cur.execute('SELECT COUNT(1) as total FROM documents;').fetchone()
+                    rslt = cur.execute('SELECT COUNT(1) as total FROM documents;').fetchone()
                     self._total = rslt['total']
             except Exception as e:
                 logger.error(e)
@@ -74,11 +132,10 @@ class Dataset:
     @property
     def columns(self) -> set[str]:
         if self._columns is None:
-            with self as db:
+            with self.cursor() as cur:
                 logger.debug(f'Loading columns for {self.key}')
-                rslt = db.cur.execute('PRAGMA table_info(documents);').fetchall()
+                rslt = cur.execute('PRAGMA table_info(documents);').fetchall()
                 self._columns = set([r['name'] for r in rslt])
-                print(self._columns)
         return self._columns
 
     @property
@@ -94,6 +151,182 @@ class Dataset:
             self._document_columns = self.columns.intersection(Document.model_fields.keys())
         return self._document_columns
 
+    @property
+    def search_columns(self) -> list[str]:
+        """
+        Columns of the full-text search index that can be searched in (i.e. excl. the document id).
+        """
+        if self._search_columns is None:
+            with self.cursor() as cur:
+                rslt = cur.execute('PRAGMA table_info(search);').fetchall()
+                self._search_columns = [r['name'] for r in rslt if r['name'] != 'idx']
+        return self._search_columns
+
+    @property
+    def search_id(self) -> str:
+        """
+        Expression for the document id in the search table: FTS5 tables written with `content_rowid='idx'` use
+        the document id as rowid, which is much cheaper to read than the (unindexed) `idx` column of older exports.
+        """
+        if self._search_id is None:
+            with self.cursor() as cur:
+                rslt = cur.execute("SELECT sql FROM sqlite_master WHERE name = 'search';").fetchone()
+                self._search_id = 'rowid' if rslt is not None and "content_rowid='idx'" in rslt['sql'] else 'idx'
+        return self._search_id
+
+    @property
+    def version(self) -> str:
+        """
+        Short fingerprint of the database file; changes whenever the file is replaced or modified.
+        Datasets with a manifest use (a prefix of) the content hash recorded at export time instead.
+        """
+        if self._version is None:
+            stat = self.db_file.stat()
+            fingerprint = f'{self.db_file.name}:{stat.st_size}:{stat.st_mtime_ns}'
+            self._version = hashlib.blake2b(fingerprint.encode(), digest_size=8).hexdigest()
+        return self._version
+
+    @property
+    def cache_namespace(self) -> str:
+        """
+        Prefix of all cache keys derived from this version of the dataset (so they can be invalidated together).
+        """
+        return f'api:{self.key}:{self.version}'
+
+    @property
+    def scores(self) -> LabelScores | None:
+        """
+        Memory-mapped matrix of all label scores (see `LabelScores`) or None if it could not be loaded.
+        """
+        if self._scores is None and not self._scores_failed:
+            with self._scores_lock:
+                if self._scores is None and not self._scores_failed:
+                    try:
+                        with self.cursor() as cur:
+                            self._scores = LabelScores.load(
+                                cur,
+                                sidecar=self.sidecar_path / f'{self.db_file.stem}.scores.npy',
+                                labels=sorted(self.label_columns),
+                                total=self.total,
+                                version=self.version,
+                            )
+                    except Exception as e:
+                        self._scores_failed = True
+                        logger.error(f'Failed to load label scores for {self.key}: {e}')
+                        logger.exception(e)
+        return self._scores
+
+    @property
+    def years(self) -> npt.NDArray[np.int16]:
+        """
+        Memory-mapped publication year per document (0 if unknown).
+        """
+        if self._years is None:
+            with self._years_lock:
+                if self._years is None:
+                    with self.cursor() as cur:
+                        self._years = load_years(
+                            cur,
+                            sidecar=self.sidecar_path / f'{self.db_file.stem}.years.npy',
+                            total=self.total,
+                            version=self.version,
+                        )
+        return self._years
+
+    @property
+    def bitmaps(self) -> BitmapFile | None:
+        """
+        Memory-mapped label masks precomputed at export time (see `lithub.util.bitmaps`), if the dataset has them.
+        """
+        if self._bitmaps is None and not self._bitmaps_failed and self.full_info.bitmaps_filename:
+            with self._bitmaps_lock:
+                if self._bitmaps is None and not self._bitmaps_failed:
+                    try:
+                        bitmaps = BitmapFile(self.path / self.full_info.bitmaps_filename)
+                        if bitmaps.total != self.total:
+                            self._bitmaps_failed = True
+                            logger.warning(f'Bitmaps for {self.key} cover {bitmaps.total:,} instead of {self.total:,} documents; ignoring them!')
+                            bitmaps.close()
+                        else:
+                            self._bitmaps = bitmaps
+                    except (OSError, ValueError) as e:
+                        self._bitmaps_failed = True
+                        logger.error(f'Failed to load bitmaps for {self.key}: {e}')
+        return self._bitmaps
+
+    @property
+    def cubes(self) -> dict[float, Cube]:
+        """
+        Label/group x year counts precomputed at export time per threshold (see `lithub.export.writers.write_cube`), if the dataset has them.
+        """
+        if self._cubes is None:
+            self._cubes = {}
+            if self.full_info.cube_filename:
+                try:
+                    self._cubes = load_cube(self.path / self.full_info.cube_filename)
+                except (OSError, ValueError) as e:
+                    logger.error(f'Failed to load cube for {self.key}: {e}')
+        return self._cubes
+
+    def cube(self, min_score: float) -> Cube | None:
+        """
+        Number of documents per label (and group) and publication year scored at least `min_score`.
+        Thresholds not precomputed at export time are computed from the score matrix (None if there is none).
+        """
+        if (cube := self.cubes.get(min_score)) is not None:
+            return cube
+        scores = self.scores
+        if scores is None:
+            return None
+        return cube_from_scores(scores, self.years, {key: group.labels or [] for key, group in self.groups.items()}, min_score)
+
+    def order(self, labels: list[str], persist: bool = False) -> npt.NDArray[np.integer] | None:
+        """
+        Document ids by descending relevance for `labels` (see `ordering.sort_order`) or None if not all of them have scores.
+        Orders are kept in memory (LRU) and, if `persist`, as sidecar files shared by all workers.
+        """
+        scores = self.scores
+        if scores is None or len(labels) == 0 or not all(label in scores for label in labels):
+            return None
+
+        key = tuple(labels)
+        with self._orders_lock:
+            order = self._orders.get(key)
+            if order is not None:
+                self._orders.move_to_end(key)
+                return order
+
+        if persist:
+            digest = hashlib.blake2b(json.dumps(labels).encode(), digest_size=8).hexdigest()
+            order = load_sidecar(
+                self.sidecar_path / f'{self.db_file.stem}.order-{digest}.npy',
+                meta={'version': self.version, 'labels': labels},
+                build=lambda: sort_order(scores, labels),
+            )
+        else:
+            order = sort_order(scores, labels)
+
+        with self._orders_lock:
+            self._orders[key] = order
+            while len(self._orders) > settings.ORDER_CACHE_SIZE:
+                self._orders.popitem(last=False)
+        return order
+
+    @property
+    def vocabulary(self) -> Vocabulary | None:
+        """
+        Terms of the full-text search index (see `Vocabulary`) or None if they could not be loaded.
+        """
+        if self._vocabulary is None:
+            with self._vocabulary_lock:
+                if self._vocabulary is None:
+                    try:
+                        with self.cursor() as cur:
+                            self._vocabulary = Vocabulary.from_db(cur, min_docs=settings.SUGGEST_MIN_DOCS)
+                    except Exception as e:
+                        logger.error(f'Failed to load search vocabulary for {self.key}: {e}')
+        return self._vocabulary
+
     @property
     def mailing_active(self) -> bool:
         # FIXME error: Incompatible return value type (got "list[str] | bool | None", expected "bool")  [return-value]
@@ -121,62 +354,260 @@ class Dataset:
             raise ValueError(f'Invalid column name: {col}')
         return f'"{col}"'
 
-    def __enter__(self) -> 'Dataset':
-        self.con: sqlite3.Connection = sqlite3.connect(self.db_file)
-        self.con.row_factory = sqlite3.Row
-        self.con.set_trace_callback(self.logger.debug)
-        self.cur: sqlite3.Cursor = self.con.cursor()
+    @contextmanager
+    def cursor(self) -> Generator[sqlite3.Cursor, None, None]:
+        """
+        Borrow a cursor on a pooled, read-only connection to this dataset's database.
+        The connection is returned to the pool when the context exits.
+        """
+        with self.pool.cursor() as cur:
+            yield cur
 
-        return self
+    async def run(self, fn: Callable[..., R], *args: Any, timeout: float | None = None) -> R:
+        """
+        Run `fn(cursor, *args)` in the database executor, so blocking queries stay off the event loop.
+        """
+        return await self.pool.run(fn, *args, timeout=timeout)
 
-    def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> None:
-        self.con.close()
+    def iterate(self, fn: Callable[..., Iterator[R]], *args: Any) -> AsyncGenerator[R, None]:
+        """
+        Iterate `fn(cursor, *args)` step by step in the database executor (see `ConnectionPool.iterate`).
+        """
+        return self.pool.iterate(fn, *args)
+
+    def close(self) -> None:
+        """
+        Release resources of a dataset that is no longer served; requests still using it can finish.
+        """
+        self.pool.close()
+
+
+class ReloadSummary(BaseModel):
+    added: list[str]
+    updated: list[str]
+    removed: list[str]
+    unchanged: list[str]
 
 
 class DatasetCache:
+    # Touched to make the watchers of all workers reload their datasets (see `watch`)
+    RELOAD_MARKER = '.reload'
+
     def __init__(self, base_path: Path):
         logger.info(f'Setting up dataset cache for {base_path}')
         self.base_path = base_path
         self.datasets: dict[str, Dataset] = {}
+        self._reload_lock = threading.Lock()
+        # Serialised infos of all datasets along with the datasets they were built from
+        self._infos: tuple[dict[str, Dataset], Payload] | None = None
+
+    def reload(self, warm_first: bool = False) -> tuple[ReloadSummary, list[Dataset]]:
+        """
+        (Re-)discover all datasets and swap them in at once. Datasets whose meta-data and database did not change
+        are kept as they are (incl. everything they have loaded already).
+        If `warm_first`, new datasets are warmed up before they are swapped in (otherwise, in the background afterwards).
+
+        Returns what changed and the datasets that are no longer served (see `refresh` for cleaning them up).
+        """
+        with self._reload_lock:
+            entries = sorted(self.base_path.iterdir())
+            # Datasets are independent and loading them is mostly waiting for the disk, so do that in parallel
+            with ThreadPoolExecutor(max_workers=settings.DATASETS_LOAD_WORKERS, thread_name_prefix='datasets') as pool:
+                loaded = {dataset.key: dataset for dataset in pool.map(self._load, entries) if dataset is not None}
+
+            current = self.datasets
+            unchanged = [
+                key
+                for key, dataset in loaded.items()
+                if key in current and current[key].fingerprint == dataset.fingerprint and current[key].version == dataset.version
+            ]
+            fresh = [dataset for key, dataset in loaded.items() if key not in unchanged]
+            if warm_first:
+                self.warm_up(fresh)
+
+            # Replacing the dict (instead of updating it) makes the swap atomic for readers
+            self.datasets = {key: current[key] if key in unchanged else dataset for key, dataset in loaded.items()}
+            retired = [dataset for key, dataset in current.items() if key not in unchanged]
 
-    def reload(self) -> None:
-        # Reset list of datasets
-        self.datasets = {}
-        # Iterate the dataset folder
-        for entry in self.base_path.iterdir():
-            logger.info(f'Checking if folder {entry} is a dataset')
-            # Only consider folders (excl. those starting with ".") that contain a 'info.json' file
-            if entry.is_dir() and (entry / 'info.json').exists() and not entry.name.startswith('.'):
+        summary = ReloadSummary(
+            added=[key for key in loaded.keys() if key not in current],
+            updated=[key for key in loaded.keys() if key in current and key not in unchanged],
+            removed=[key for key in current.keys() if key not in loaded],
+            unchanged=unchanged,
+        )
+        if not warm_first and settings.DATASETS_WARMUP:
+            # Probe everything the first requests would need in the background instead of delaying startup
+            threading.Thread(target=self.warm_up, args=(fresh,), name='datasets-warmup', daemon=True).start()
+        return summary, retired
+
+    async def refresh(self) -> ReloadSummary:
+        """
+        Reload datasets in the background, warm up new versions, and swap them in.
+        Requests that already started finish on the old version, whose cache entries are dropped.
+        """
+        summary, retired = await run_in_executor(self.reload, True)
+        for dataset in retired:
+            namespace = f'{dataset.cache_namespace}:'
+            dropped = await memory.clear(namespace=namespace) + await search_memory.clear(namespace=namespace)
+            dataset.close()
+            logger.info(f'Retired {dataset.key} (version {dataset.version}), dropped {dropped} cache entries.')
+        logger.info(f'Reloaded datasets: {summary}')
+        return summary
+
+    def state(self, marker_only: bool = False) -> str:
+        """
+        Fingerprint of everything in the datasets folder that `reload` depends on, to detect changes cheaply
+        (or only of the marker touched by `request_reload`).
+        """
+        h = hashlib.blake2b(digest_size=16)
+        for entry in sorted(self.base_path.iterdir()):
+            if entry.name == self.RELOAD_MARKER or (not marker_only and entry.is_dir() and not entry.name.startswith('.')):
+                files = [entry] if entry.is_file() else [entry / 'info.json', entry / 'manifest.json']
                 try:
                     with open(entry / 'info.json', 'r') as f:
-                        # Read meta-data from info file
-                        info = DatasetInfoFull.model_validate(json.loads(f.read()))
-
-                    # verify files exist
-                    if not (entry / info.db_filename).exists():
-                        logger.warning(f'Dataset in {entry.name} is missing db_filename; ignoring dataset!')
-                        continue
-                    if not (entry / info.arrow_filename).exists():
-                        logger.warning(f'Dataset in {entry.name} is missing arrow_file; ignoring dataset!')
-                        continue
-                    if not info.keywords_filename or not (entry / info.keywords_filename).exists():
-                        logger.warning(f'Dataset in {entry.name} is missing keywords_file!')
-
-                    # Append to list of known datasets
-                    dataset = Dataset(info=info, key=entry.name, path=entry.absolute())
-                    self.datasets[dataset.key] = dataset
-
-                    # Log this (indirectly also fetches the dataset size from the database)
-                    logger.info(f'Loaded {entry.name} with {dataset.total:,} documents.')
-
-                except ValidationError as e:
-                    logger.warning(f'Failed to validate dataset info at {entry.name}')
-                    logger.exception(e)
+                        files.append(entry / json.load(f)['db_filename'])
+                except (OSError, ValueError, KeyError, TypeError):
+                    pass
+                for file in files:
+                    try:
+                        stat = file.stat()
+                        h.update(f'{file}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+                    except OSError:
+                        h.update(f'{file}:-;'.encode())
+        return h.hexdigest()
+
+    async def watch(self, interval: float, marker_only: bool = False) -> None:
+        """
+        Check the datasets folder for changes every `interval` seconds and `refresh` when something changed
+        (or only when another worker called `request_reload`).
+        """
+        last = await run_in_executor(self.state, marker_only)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                state = await run_in_executor(self.state, marker_only)
+                if state != last:
+                    logger.info(f'Change detected in {self.base_path}, reloading datasets')
+                    await self.refresh()
+                    last = state
+            except Exception as e:
+                logger.error(f'Failed to reload datasets: {e}')
+                logger.exception(e)
+
+    def request_reload(self) -> None:
+        """
+        Make the watchers of all workers (incl. this one) pick up changes on their next check.
+        """
+        (self.base_path / self.RELOAD_MARKER).touch()
+
+    @staticmethod
+    def _read_manifest(entry: Path, info: DatasetInfoFull) -> DatasetManifest | None:
+        if not (entry / 'manifest.json').exists():
+            return None
+        try:
+            with open(entry / 'manifest.json', 'r') as f:
+                manifest = DatasetManifest.model_validate_json(f.read())
+        except (OSError, ValidationError) as e:
+            logger.warning(f'Failed to read manifest of {entry.name}: {e}')
+            return None
+        if info.db_filename not in manifest.files:
+            logger.warning(f'Manifest of {entry.name} does not cover {info.db_filename}; ignoring it!')
+            return None
+        # Checking sizes and modification times is cheap and catches files that were replaced after the manifest was written
+        # (otherwise, a stale hash would become the dataset's version, and with it outdated sidecars and cache entries)
+        for name, file in manifest.files.items():
+            stat = (entry / name).stat() if (entry / name).exists() else None
+            if stat is None:
+                logger.warning(f'Manifest of {entry.name} lists {name}, which is missing; ignoring it!')
+                return None
+            if stat.st_size != file.size:
+                logger.warning(f'Manifest of {entry.name} does not match {name} (size {stat.st_size:,} instead of {file.size:,}); ignoring it!')
+                return None
+            if stat.st_mtime_ns != file.mtime_ns:
+                # Most likely copied without preserving modification times, so only the contents can tell
+                logger.warning(
+                    f'Modification time of {name} does not match the manifest of {entry.name}, checking its hash instead '
+                    f'(this slows down loading; copy datasets with their modification times, e.g. `cp -p` or `rsync -t`)'
+                )
+                if ManifestFile.digest(entry / name) != file.blake2b:
+                    logger.warning(f'Manifest of {entry.name} does not match the contents of {name}; ignoring it!')
+                    return None
+        return manifest
+
+    def _load(self, entry: Path) -> Dataset | None:
+        logger.info(f'Checking if folder {entry} is a dataset')
+        # Only consider folders (excl. those starting with ".") that contain a 'info.json' file
+        if not entry.is_dir() or not (entry / 'info.json').exists() or entry.name.startswith('.'):
+            logger.info(f'Ignoring data in {entry.name} (info.json: {(entry / "info.json").exists()}, entry_name: {entry.name})')
+            return None
+        try:
+            with open(entry / 'info.json', 'r') as f:
+                # Read meta-data from info file
+                info = DatasetInfoFull.model_validate(json.loads(f.read()))
+
+            # verify files exist
+            if not (entry / info.db_filename).exists():
+                logger.warning(f'Dataset in {entry.name} is missing db_filename; ignoring dataset!')
+                return None
+            if not (entry / info.arrow_filename).exists():
+                logger.warning(f'Dataset in {entry.name} is missing arrow_file; ignoring dataset!')
+                return None
+            if not info.keywords_filename or not (entry / info.keywords_filename).exists():
+                logger.warning(f'Dataset in {entry.name} is missing keywords_file!')
+
+            manifest = self._read_manifest(entry, info)
+            dataset = Dataset(info=info, key=entry.name, path=entry.absolute(), manifest=manifest)
+            if manifest is not None:
+                logger.info(f'Loaded {entry.name} with {manifest.total:,} documents (from manifest).')
             else:
-                logger.info(f'Ignoring data in {entry.name} (info.json: {(entry / "info.json").exists()}, entry_name: {entry.name})')
+                # The size of the dataset is only probed when first needed
+                logger.info(f'Loaded {entry.name} (no manifest).')
+            return dataset
+
+        except ValidationError as e:
+            logger.warning(f'Failed to validate dataset info at {entry.name}')
+            logger.exception(e)
+            return None
+
+    @property
+    def infos_payload(self) -> Payload:
+        """
+        Serialised list of the infos of all datasets, rebuilt whenever datasets were swapped.
+        """
+        datasets = self.datasets
+        infos = self._infos
+        if infos is None or infos[0] is not datasets:
+            content = b'[' + b','.join(dataset.info_payload.content for dataset in datasets.values()) + b']'
+            infos = self._infos = (datasets, Payload(content))
+        return infos[1]
+
+    @staticmethod
+    def warm_up(datasets: list[Dataset]) -> None:
+        """
+        Load everything the first requests to each dataset need (also happens lazily on first use).
+        """
+        with ThreadPoolExecutor(max_workers=settings.DATASETS_LOAD_WORKERS, thread_name_prefix='datasets-warmup') as pool:
+            list(pool.map(DatasetCache._warm_up, datasets))
+
+    @staticmethod
+    def _warm_up(dataset: Dataset) -> None:
+        try:
+            logger.info(f'Warming up {dataset.key} with {dataset.total:,} documents.')
+            # Requested on every page load
+            logger.info(f'Serialised info of {dataset.key} ({len(dataset.info_payload.content):,} bytes).')
+            # Materialise (or memory-map) label scores, so the first mask request does not have to
+            if dataset.scores is not None:
+                logger.info(f'Loaded scores for {len(dataset.scores.labels)} labels of {dataset.key}.')
+            if dataset.bitmaps is not None:
+                logger.info(f'Loaded {len(dataset.bitmaps.offsets)} precomputed bitmaps of {dataset.key}.')
+            # Suggestions have to be fast from the first keystroke on
+            if dataset.vocabulary is not None:
+                logger.info(f'Loaded {len(dataset.vocabulary):,} search terms of {dataset.key}.')
+        except Exception as e:
+            logger.error(f'Failed to warm up {dataset.key}: {e}')
 
 
 datasets = DatasetCache(base_path=Path(settings.DATASETS_FOLDER))
 datasets.reload()
 
-__all__ = ['datasets', 'Dataset', 'DatasetInfoWeb']
+__all__ = ['datasets', 'Dataset', 'DatasetInfoWeb', 'ReloadSummary']
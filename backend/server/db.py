@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Empty, LifoQueue
+from typing import Any, AsyncGenerator, Callable, Generator, Iterator, ParamSpec, TypeVar
+
+from pydantic import BaseModel
+
+from .logging import get_logger
+from .config import settings
+
+logger = get_logger('util.db')
+
+P = ParamSpec('P')
+R = TypeVar('R')
+
+# Dedicated threads for all blocking database work, so queries never run on the event loop
+executor = ThreadPoolExecutor(max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix='lithub-db')
+
+
+class PoolExhaustedError(Exception):
+    status = 503
+
+
+class QueryTimeoutError(Exception):
+    status = 504
+
+
+class _Job:
+    """
+    Keeps track of the connection a job is running on, so that it can be interrupted
+    from the event loop without accidentally hitting a connection already handed to someone else.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.con: sqlite3.Connection | None = None
+        self.cancelled = False
+
+    def interrupt(self) -> None:
+        with self.lock:
+            self.cancelled = True
+            if self.con is not None:
+                self.con.interrupt()
+
+
+class PoolStats(BaseModel):
+    size: int  # maximum number of connections
+    opened: int  # connections currently open
+    in_use: int  # connections currently checked out
+    idle: int  # open connections waiting in the pool
+    acquired: int  # total number of checkouts
+    waited: int  # number of checkouts that had to wait for a free connection
+    wait_time_total: float  # accumulated seconds spent waiting
+    wait_time_max: float  # longest single wait in seconds
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only SQLite connections for one database file.
+
+    Connections are opened lazily (up to `size`) in URI mode (`mode=ro`, optionally `immutable=1`)
+    and tuned via pragmas, so they keep a warm page cache between requests.
+    Connections are handed out to one thread at a time, but may move between threads.
+    """
+
+    def __init__(
+        self,
+        db_file: Path,
+        size: int = settings.DB_POOL_SIZE,
+        timeout: float = settings.DB_POOL_TIMEOUT,
+        immutable: bool = settings.DB_IMMUTABLE,
+        name: str | None = None,
+    ):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self.immutable = immutable
+        self.logger = get_logger(f'util.db.{name or db_file.stem}')
+
+        # Never holds more than `size` connections, but may get a wake-up (None) per waiting thread when the pool is closed
+        self._idle: LifoQueue[sqlite3.Connection | None] = LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._waited = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._waiting = 0
+        self._closed = False
+
+    @property
+    def uri(self) -> str:
+        uri = f'{self.db_file.absolute().as_uri()}?mode=ro'
+        if self.immutable:
+            uri += '&immutable=1'
+        return uri
+
+    def _connect(self) -> sqlite3.Connection:
+        self.logger.debug(f'Opening new connection to {self.uri}')
+        con = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        con.execute(f'PRAGMA mmap_size = {int(settings.DB_MMAP_SIZE)};')
+        con.execute(f'PRAGMA cache_size = {int(settings.DB_CACHE_SIZE)};')
+        con.execute('PRAGMA temp_store = MEMORY;')
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # Tracing costs a Python call per statement, so only install it when the statements are logged anyway
+            con.set_trace_callback(self.logger.debug)
+        return con
+
+    def _open(self) -> sqlite3.Connection:
+        # The caller already counted the connection in `_opened`
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _checkout(self) -> sqlite3.Connection:
+        # Fast path: reuse an idle connection
+        try:
+            con = self._idle.get_nowait()
+            if con is not None:
+                return con
+            # Wake-up meant for a thread waiting on a closed pool, pass it on
+            self._idle.put_nowait(None)
+        except Empty:
+            pass
+
+        with self._lock:
+            if self._closed or self._opened < self.size:
+                # Pool not yet at capacity (or closed, see below): open a new connection
+                self._opened += 1
+                open_new = True
+            else:
+                # Pool is at capacity: wait for someone to return a connection
+                self._waiting += 1
+                open_new = False
+        if open_new:
+            return self._open()
+
+        start = time.perf_counter()
+        try:
+            con = self._idle.get(timeout=self.timeout)
+        except Empty:
+            raise PoolExhaustedError(f'No database connection available for {self.db_file.name} after {self.timeout}s')
+        finally:
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._waiting -= 1
+                self._waited += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+        self.logger.debug(f'Waited {waited:.4f}s for a connection')
+        if con is None:
+            # The pool was closed while we waited (released connections are not returned anymore),
+            # but requests that started before its dataset was retired should still finish
+            with self._lock:
+                self._opened += 1
+            return self._open()
+        return con
+
+    def acquire(self) -> sqlite3.Connection:
+        con = self._checkout()
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+        return con
+
+    def release(self, con: sqlite3.Connection) -> None:
+        with self._lock:
+            self._in_use -= 1
+            closed = self._closed
+            if closed:
+                self._opened -= 1
+        if closed:
+            con.close()
+            return
+        if con.in_transaction:
+            con.rollback()
+        self._idle.put_nowait(con)
+
+    @contextmanager
+    def connection(self) -> Generator[sqlite3.Connection, None, None]:
+        con = self.acquire()
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    @contextmanager
+    def cursor(self) -> Generator[sqlite3.Cursor, None, None]:
+        with self.connection() as con:
+            cur = con.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    async def run(self, fn: Callable[..., R], *args: Any, timeout: float | None = None) -> R:
+        """
+        Run `fn(cursor, *args)` on a pooled connection in the database executor.
+        Queries exceeding `timeout` (default: `DB_QUERY_TIMEOUT`) seconds are interrupted and raise a `QueryTimeoutError`.
+        """
+        job = _Job()
+
+        def task() -> R:
+            with self.connection() as con:
+                with job.lock:
+                    if job.cancelled:
+                        raise QueryTimeoutError('Query was cancelled before it started')
+                    job.con = con
+                cur = con.cursor()
+                try:
+                    return fn(cur, *args)
+                finally:
+                    cur.close()
+                    with job.lock:
+                        job.con = None
+
+        return await _run_interruptible(task, job, timeout=settings.DB_QUERY_TIMEOUT if timeout is None else timeout)
+
+    async def iterate(self, fn: Callable[..., Iterator[R]], *args: Any) -> AsyncGenerator[R, None]:
+        """
+        Iterate `fn(cursor, *args)` on a pooled connection, advancing it one item at a time in the database executor.
+        Nothing is computed ahead of the consumer, so a slow consumer (e.g. a slow client) naturally throttles the query.
+        If the consumer stops early (e.g. because the client disconnected), the running query is interrupted,
+        and the iterator is closed and its connection released as soon as the current step returns.
+        """
+        acquiring = executor.submit(self.acquire)
+        try:
+            con = await asyncio.wrap_future(acquiring)
+        except asyncio.CancelledError:
+            # The connection may still arrive after we stopped waiting for it
+            acquiring.add_done_callback(lambda f: None if f.cancelled() or f.exception() else self.release(f.result()))
+            raise
+        cur = con.cursor()
+        it = fn(cur, *args)
+        step: Future[Any] | None = None
+        done = object()
+        finished = False
+        try:
+            while True:
+                step = executor.submit(next, it, done)
+                item = await asyncio.wrap_future(step)
+                if item is done:
+                    finished = True
+                    return
+                yield item
+        finally:
+            if not finished:
+                self.logger.debug('Iteration aborted, interrupting query')
+                con.interrupt()
+
+            def cleanup() -> None:
+                # Iterators can't be closed while they are being advanced in another thread
+                if step is not None:
+                    wait([step])
+                try:
+                    if (close := getattr(it, 'close', None)) is not None:
+                        close()
+                except Exception as e:
+                    self.logger.debug(f'Failed to close aborted iterator: {e}')
+                finally:
+                    cur.close()
+                    self.release(con)
+
+            executor.submit(cleanup)
+
+    def close(self) -> None:
+        """
+        Close all idle connections; connections still in use are closed when they are released (so queries can finish).
+        Threads waiting for a connection (and any later ones) get a connection of their own, which is closed after use.
+        """
+        with self._lock:
+            self._closed = True
+            waiting = self._waiting
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except Empty:
+                break
+            if con is None:
+                continue
+            con.close()
+            with self._lock:
+                self._opened -= 1
+        for _ in range(waiting):
+            self._idle.put_nowait(None)
+
+    @property
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                size=self.size,
+                opened=self._opened,
+                in_use=self._in_use,
+                idle=self._idle.qsize(),
+                acquired=self._acquired,
+                waited=self._waited,
+                wait_time_total=self._wait_time_total,
+                wait_time_max=self._wait_time_max,
+            )
+
+
+async def run_in_executor(fn: Callable[P, R], *args: P.args, **kwargs: P.kwargs) -> R:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, lambda: fn(*args, **kwargs))
+
+
+async def _run_interruptible(fn: Callable[[], R], job: _Job, timeout: float | None = None) -> R:
+    # A timeout of `0` or `None` means no timeout
+    future = run_in_executor(fn)
+    try:
+        return await asyncio.wait_for(future, timeout=timeout or None)
+    except (TimeoutError, asyncio.CancelledError) as e:
+        job.interrupt()
+        if isinstance(e, TimeoutError):
+            raise QueryTimeoutError(f'Query took longer than {timeout}s')
+        raise
+
+
+__all__ = ['ConnectionPool', 'PoolStats', 'PoolExhaustedError', 'QueryTimeoutError', 'executor', 'run_in_executor']
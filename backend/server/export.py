@@ -0,0 +1,421 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Generator, Iterable, Literal
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+from pydantic import BaseModel
+
+from .bitmask import Bitmask
+from .config import settings
+from .datasets import Dataset
+from .db import run_in_executor
+from .logging import get_logger
+from .util import IDS_FILTER, ids_param
+
+logger = get_logger('util.export')
+
+ExportFormatKey = Literal['csv', 'ndjson', 'arrow', 'parquet']
+Compression = Literal['zstd']
+
+
+@dataclass
+class ExportFormat:
+    media_type: str
+    extension: str
+    # Whether the format compresses internally (otherwise, the whole stream gets compressed)
+    native_compression: bool = False
+
+
+FORMATS: dict[ExportFormatKey, ExportFormat] = {
+    'csv': ExportFormat(media_type='text/csv', extension='csv'),
+    'ndjson': ExportFormat(media_type='application/x-ndjson', extension='ndjson'),
+    'arrow': ExportFormat(media_type='application/vnd.apache.arrow.stream', extension='arrows', native_compression=True),
+    'parquet': ExportFormat(media_type='application/vnd.apache.parquet', extension='parquet', native_compression=True),
+}
+
+
+def media_type(fmt: ExportFormatKey, compression: Compression | None) -> str:
+    if compression is not None and not FORMATS[fmt].native_compression:
+        return 'application/zstd'
+    return FORMATS[fmt].media_type
+
+
+def filename(name: str, fmt: ExportFormatKey, compression: Compression | None) -> str:
+    if compression is not None and not FORMATS[fmt].native_compression:
+        return f'{name}.{FORMATS[fmt].extension}.zst'
+    return f'{name}.{FORMATS[fmt].extension}'
+
+
+def _arrow_type(decl_type: str) -> pa.DataType:
+    decl_type = decl_type.upper()
+    if 'INT' in decl_type:
+        return pa.int64()
+    if any(t in decl_type for t in ('REAL', 'FLOA', 'DOUB')):
+        return pa.float64()
+    return pa.string()
+
+
+def arrow_schema(cur: sqlite3.Cursor, cols: list[str]) -> pa.Schema:
+    """
+    Arrow schema for the `documents` columns `cols` derived from the declared SQLite column types.
+    Declaring it upfront keeps batches consistent, even if a column is entirely NULL in some of them.
+    """
+    decl_types = {r['name']: r['type'] for r in cur.execute('PRAGMA table_info(documents);')}
+    return pa.schema([(col, _arrow_type(decl_types.get(col, ''))) for col in cols])
+
+
+def fetch_batches(cur: sqlite3.Cursor, mask: Bitmask | None, batch_size: int) -> Generator[list[sqlite3.Row], None, None]:
+    """
+    Fetch all documents (or those in `mask`) in id order, `batch_size` rows at a time.
+    """
+    if mask is None:
+        rslt = cur.execute('SELECT * FROM documents ORDER BY idx;')
+        while batch := rslt.fetchmany(batch_size):
+            yield batch
+        return
+    # Query the selection in (ascending) batches of ids, so no huge id list has to be materialised at once
+    for ids in mask.iter_batches():
+        rslt = cur.execute(f'SELECT * FROM documents WHERE {IDS_FILTER} ORDER BY idx;', {'ids': ids_param(ids)})
+        while batch := rslt.fetchmany(batch_size):
+            yield batch
+
+
+def to_record_batch(rows: list[sqlite3.Row], schema: pa.Schema) -> pa.RecordBatch:
+    # Transpose rows into columns once instead of building a dict per row
+    columns = list(zip(*rows, strict=True))
+    keys = rows[0].keys()
+    arrays = [pa.array(columns[keys.index(field.name)], type=field.type) for field in schema]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Spool:
+    """
+    Write-only file object that collects everything written to it until it is drained.
+    """
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _ndjson(batch: pa.RecordBatch) -> bytes:
+    return ''.join(f'{json.dumps(row)}\n' for row in batch.to_pylist()).encode()
+
+
+def export(
+    batches: Iterable[list[sqlite3.Row]],
+    schema: pa.Schema,
+    fmt: ExportFormatKey = 'csv',
+    compression: Compression | None = None,
+) -> Generator[bytes, None, None]:
+    """
+    Encode row batches into `fmt` and yield the encoded bytes batch by batch.
+    Arrow and Parquet use their built-in (per-buffer/per-page) compression, other formats are compressed as a whole.
+    """
+    spool = _Spool()
+    sink = pa.PythonFile(spool, mode='w')
+    stream: pa.NativeFile = sink
+    if compression is not None and not FORMATS[fmt].native_compression:
+        stream = pa.CompressedOutputStream(sink, compression)
+
+    writer: pa_csv.CSVWriter | pa_ipc.RecordBatchStreamWriter | pq.ParquetWriter | None = None
+    if fmt == 'csv':
+        # Only quote values that need it (like the csv module did before)
+        writer = pa_csv.CSVWriter(stream, schema, write_options=pa_csv.WriteOptions(quoting_style='needed'))
+    elif fmt == 'arrow':
+        writer = pa_ipc.new_stream(stream, schema, options=pa_ipc.IpcWriteOptions(compression=compression))  # type: ignore[no-untyped-call]
+    elif fmt == 'parquet':
+        writer = pq.ParquetWriter(stream, schema, compression=compression or 'snappy')  # type: ignore[no-untyped-call]
+
+    for rows in batches:
+        batch = to_record_batch(rows, schema)
+        if writer is None:
+            stream.write(_ndjson(batch))
+        else:
+            writer.write_batch(batch)
+        if data := spool.drain():
+            yield data
+
+    if writer is not None:
+        writer.close()
+    if stream is not sink:
+        stream.close()
+    sink.close()
+    if data := spool.drain():
+        yield data
+
+
+def coalesce(chunks: Iterable[bytes], min_size: int) -> Generator[bytes, None, None]:
+    """
+    Join consecutive chunks until they are at least `min_size` bytes large.
+    """
+    buffer: list[bytes] = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if size > 0:
+        yield b''.join(buffer)
+
+
+class ExportJob(BaseModel):
+    key: str
+    dataset: str
+    status: Literal['pending', 'running', 'done', 'failed']
+    format: ExportFormatKey
+    compression: Compression | None = None
+    filename: str  # name to offer the file for download as
+    size: int | None = None  # in bytes, once done
+    error: str | None = None
+
+
+class ExportSpool:
+    """
+    Background export jobs, whose state and results are kept in `folder` and shared by all workers.
+
+    Jobs are keyed by a hash of the dataset version, the mask, and the output format,
+    so repeated requests for the same selection are served from the existing file (or wait for the running job).
+    """
+
+    # Identifies this worker in job descriptors, so others can tell when a job's worker is gone
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+
+    def __init__(self, folder: Path, max_jobs: int, max_age: int):
+        self.folder = folder
+        self.max_age = max_age
+        self.jobs: dict[str, ExportJob] = {}  # pending and running jobs of this worker
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._lock = threading.Lock()  # claims run in executor threads
+
+    @staticmethod
+    def job_key(dataset: Dataset, mask: Bitmask | None, fmt: ExportFormatKey, compression: Compression | None) -> str:
+        h = hashlib.blake2b(f'{dataset.key}:{dataset.version}:{fmt}:{compression}:'.encode(), digest_size=16)
+        if mask is not None:
+            h.update(mask.to_bytes())
+        return h.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.folder / f'{key}.export'
+
+    def _meta_path(self, key: str) -> Path:
+        return self.folder / f'{key}.json'
+
+    @staticmethod
+    def _alive(owner: str | None) -> bool:
+        host, _, pid = (owner or '').rpartition(':')
+        if host != socket.gethostname() or not pid.isdigit():
+            # No way to tell for workers on other machines
+            return True
+        if int(pid) == os.getpid():
+            # Our own jobs are in `jobs` while they run, so this one was started by an earlier process with the same pid
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _save(self, job: ExportJob) -> None:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        tmp = self.folder / f'.{job.key}.{os.getpid()}.json.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({**job.model_dump(mode='json'), 'owner': self.owner}, f)
+            os.replace(tmp, self._meta_path(job.key))
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _create(self, job: ExportJob) -> bool:
+        # Creating the descriptor is atomic, so of several workers submitting the same export, exactly one runs it
+        self.folder.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self._meta_path(job.key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({**job.model_dump(mode='json'), 'owner': self.owner}, f)
+        return True
+
+    def _load(self, key: str) -> tuple[ExportJob, int] | None:
+        # Job as described on disk, and the descriptor's inode (to tell whether another worker replaced it since)
+        try:
+            with open(self._meta_path(key), 'r') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                descriptor = json.load(f)
+            job = ExportJob.model_validate(descriptor)
+        except (OSError, ValueError):
+            return None
+        if job.status == 'done':
+            try:
+                job.size = self.path(key).stat().st_size
+            except OSError:
+                job.status, job.size, job.error = 'failed', None, 'Export has expired'
+        elif job.status != 'failed' and not self._alive(descriptor.get('owner')):
+            job.status, job.error = 'failed', 'Export was interrupted'
+        return job, inode
+
+    def get(self, key: str) -> ExportJob | None:
+        if not key.isalnum():
+            # Keys are hex digests, anything else must not be used to construct file paths
+            return None
+        if (job := self.jobs.get(key)) is not None:
+            return job
+        # Jobs are looked up on disk, they may be run (or have been run) by another worker (or have expired)
+        loaded = self._load(key)
+        return loaded[0] if loaded is not None else None
+
+    def claim(self, dataset: Dataset, mask: Bitmask | None, fmt: ExportFormatKey, compression: Compression | None) -> tuple[ExportJob, bool]:
+        """
+        Find the job for this export, or create it for this worker if there is none (or only a failed one).
+        Returns the job and whether it was created, i.e. still needs to be started; this blocks, so run it in the executor.
+        """
+        key = self.job_key(dataset, mask, fmt, compression)
+        with self._lock:
+            if (job := self.jobs.get(key)) is not None:
+                return job, False
+            if (loaded := self._load(key)) is not None:
+                job, inode = loaded
+                if job.status != 'failed':
+                    return job, False
+                # Make way for a new attempt, unless another worker replaced the failed job already
+                try:
+                    if os.stat(self._meta_path(key)).st_ino == inode:
+                        self._meta_path(key).unlink()
+                except FileNotFoundError:
+                    pass
+
+            job = ExportJob(
+                key=key,
+                dataset=dataset.key,
+                status='pending',
+                format=fmt,
+                compression=compression,
+                filename=filename(dataset.key, fmt, compression),
+            )
+            if not self._create(job):
+                # Another worker was faster (if its descriptor can't be read yet, it is still writing it)
+                loaded = self._load(key)
+                return (loaded[0] if loaded is not None else job), False
+            self.jobs[key] = job
+            return job, True
+
+    async def submit(self, dataset: Dataset, mask: Bitmask | None, fmt: ExportFormatKey, compression: Compression | None) -> ExportJob:
+        job, created = await run_in_executor(self.claim, dataset, mask, fmt, compression)
+        if created:
+            # Keep a reference to the task, so it does not get garbage collected while running
+            task = asyncio.create_task(self._run(job, dataset, mask))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: ExportJob, dataset: Dataset, mask: Bitmask | None) -> None:
+        async with self._slots:
+            job.status = 'running'
+            try:
+                self._save(job)
+                await run_in_executor(self._write, job, dataset, mask)
+                job.status = 'done'
+                logger.info(f'Finished export {job.key} ({job.size:,} bytes)')
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+                logger.error(f'Export {job.key} failed: {e}')
+                logger.exception(e)
+                try:
+                    self._save(job)
+                except OSError as e:
+                    logger.warning(f'Failed to save state of export {job.key}: {e}')
+            finally:
+                # From now on, the job is looked up on disk
+                self.jobs.pop(job.key, None)
+
+    def _write(self, job: ExportJob, dataset: Dataset, mask: Bitmask | None) -> None:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.sweep()
+        cols = list(dataset.document_columns) + list(dataset.label_columns)
+        # Write to temporary files first, so other workers never serve partial files
+        tmp = self.folder / f'.{job.key}.{os.getpid()}.tmp'
+        try:
+            with dataset.cursor() as cur, open(tmp, 'wb') as f:
+                for chunk in export(fetch_batches(cur, mask, settings.DOWNLOAD_BUFFER), arrow_schema(cur, cols), job.format, job.compression):
+                    f.write(chunk)
+            job.size = tmp.stat().st_size
+            os.replace(tmp, self.path(job.key))
+            self._save(job.model_copy(update={'status': 'done'}))
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def sweep(self) -> None:
+        """
+        Delete exports (and abandoned temporary files) older than `max_age` seconds.
+        """
+        cutoff = time.time() - self.max_age
+        for entry in self.folder.iterdir():
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    logger.debug(f'Deleting expired export {entry.name}')
+                    entry.unlink()
+            except OSError as e:
+                logger.warning(f'Failed to delete expired export {entry.name}: {e}')
+
+
+exports = ExportSpool(
+    folder=Path(settings.EXPORT_FOLDER) if settings.EXPORT_FOLDER else Path(tempfile.gettempdir()) / 'lithub-exports',
+    max_jobs=settings.EXPORT_MAX_JOBS,
+    max_age=settings.EXPORT_MAX_AGE,
+)
+
+__all__ = [
+    'FORMATS',
+    'ExportFormatKey',
+    'Compression',
+    'media_type',
+    'filename',
+    'arrow_schema',
+    'fetch_batches',
+    'export',
+    'coalesce',
+    'ExportJob',
+    'ExportSpool',
+    'exports',
+]
@@ -0,0 +1,97 @@
+from sqlite3 import Cursor
+
+import numpy as np
+import numpy.typing as npt
+from pydantic import BaseModel
+
+from .bitmask import Bitmask
+from .datasets import Dataset
+from .util import IDS_FILTER, ids_param
+
+# Number of documents processed at a time (bounds the size of temporary arrays)
+CHUNK_SIZE = 1 << 16
+
+
+class Facets(BaseModel):
+    total: int  # number of documents in the selection
+    labels: dict[str, int]  # documents per label with a score of at least `min_score`
+    groups: dict[str, int]  # documents with at least one label of the group (incl. subgroups) scored at least `min_score`
+    years: dict[int, int]  # documents per publication year (0 for unknown)
+
+
+def _group_rows(dataset: Dataset, labels: list[str]) -> dict[str, list[int]]:
+    index = {label: i for i, label in enumerate(labels)}
+    rows = {}
+    for key, group in dataset.groups.items():
+        group_labels = group.labels or []
+        if len(group_labels) > 0 and all(label in index for label in group_labels):
+            rows[key] = [index[label] for label in group_labels]
+    return rows
+
+
+def facets_from_scores(dataset: Dataset, mask: Bitmask | None, min_score: float) -> Facets:
+    """
+    Count documents per label, group, and year in `mask` (or all documents) in vectorised passes over the score matrix.
+    """
+    scores = dataset.scores
+    assert scores is not None
+    years = dataset.years
+    group_rows = _group_rows(dataset, scores.labels)
+
+    label_counts = np.zeros(len(scores.labels), dtype=np.int64)
+    group_counts = dict.fromkeys(group_rows.keys(), 0)
+    year_counts = np.zeros(0, dtype=np.int64)
+    total = 0
+
+    if mask is None:
+        batches = (np.arange(start, min(start + CHUNK_SIZE, dataset.total)) for start in range(0, dataset.total, CHUNK_SIZE))
+    else:
+        batches = mask.iter_batches(chunk_bytes=CHUNK_SIZE >> 3)
+
+    for ids in batches:
+        total += len(ids)
+        # Compare in float64 to get exactly the same results as SQLite does
+        passed: npt.NDArray[np.bool_] = np.greater_equal(scores.scores[:, ids], np.float64(min_score))
+        label_counts += passed.sum(axis=1)
+        for key, rows in group_rows.items():
+            group_counts[key] += int(passed[rows].any(axis=0).sum())
+        batch_years = np.bincount(years[ids].clip(min=0))
+        if len(batch_years) > len(year_counts):
+            year_counts = np.pad(year_counts, (0, len(batch_years) - len(year_counts)))
+        year_counts[: len(batch_years)] += batch_years
+
+    return Facets(
+        total=total,
+        labels={label: int(count) for label, count in zip(scores.labels, label_counts.tolist(), strict=True)},
+        groups=group_counts,
+        years={int(year): int(year_counts[year]) for year in np.flatnonzero(year_counts)},
+    )
+
+
+def facets_from_db(cur: Cursor, dataset: Dataset, mask: Bitmask | None, min_score: float) -> Facets:
+    """
+    Same as `facets_from_scores`, but using SQL aggregates (for datasets without a score matrix).
+    """
+    labels = sorted(dataset.label_columns)
+    groups = {key: group.labels for key, group in dataset.groups.items() if group.labels and all(label in labels for label in group.labels)}
+    where = f'WHERE {IDS_FILTER}' if mask is not None else ''
+    params: dict[str, str | float] = {'min_score': min_score}
+    if mask is not None:
+        params['ids'] = ids_param(mask.ids())
+
+    aggregates = [f'SUM({dataset.safe_col(label)} >= :min_score)' for label in labels]
+    aggregates += [f'SUM({" OR ".join(f"{dataset.safe_col(label)} >= :min_score" for label in group_labels)})' for group_labels in groups.values()]
+    # Datasets may have no label columns at all, so do not assume there are aggregates besides the count
+    row = cur.execute(f'SELECT {", ".join(["COUNT(1)", *aggregates])} FROM documents {where};', params).fetchone()
+    counts = [int(v or 0) for v in tuple(row)]
+
+    rslt = cur.execute(f'SELECT COALESCE(publication_year, 0) AS year, COUNT(1) AS cnt FROM documents {where} GROUP BY 1;', params)
+    return Facets(
+        total=counts[0],
+        labels=dict(zip(labels, counts[1 : len(labels) + 1], strict=True)),
+        groups=dict(zip(groups.keys(), counts[len(labels) + 1 :], strict=True)),
+        years={r['year']: r['cnt'] for r in rslt},
+    )
+
+
+__all__ = ['Facets', 'facets_from_scores', 'facets_from_db']
@@ -0,0 +1,256 @@
+import hashlib
+import json
+from functools import reduce
+from sqlite3 import Cursor
+
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+
+from .bitmask import Bitmask
+from .cache import in_flight, memory, search_memory
+from .config import settings
+from .datasets import Dataset
+from .db import run_in_executor
+from .logging import get_logger
+from .search import fts_query, normalise_query
+
+logger = get_logger('util.masks')
+
+
+def precomputed_mask(dataset: Dataset, label: str, min_score: float) -> Bitmask | None:
+    """
+    Mask for `label` at `min_score` from the (memory-mapped) bitmaps written at export time, if there is one.
+    Opens the bitmap file on first access, so call this in the executor.
+    """
+    bitmaps = dataset.bitmaps
+    if bitmaps is None or (precomputed := bitmaps.get(label, min_score)) is None:
+        return None
+    return Bitmask.from_bytes(precomputed, dataset.total)
+
+
+async def label_mask(dataset: Dataset, label: str, min_score: float = 0.5) -> Bitmask:
+    """
+    Documents with a score of at least `min_score` for `label`.
+    Served from precomputed bitmaps if possible, otherwise from the score matrix or (for non-label columns) SQLite.
+    """
+
+    def from_files() -> Bitmask | None:
+        # The first access to bitmaps or the score matrix may load (or build) them, keep that off the event loop
+        if (mask := precomputed_mask(dataset, label, min_score)) is not None:
+            return mask
+        scores = dataset.scores
+        if scores is None or label not in scores:
+            return None
+        return Bitmask.from_bool(scores.mask(label, min_score))
+
+    if (mask := await run_in_executor(from_files)) is not None:
+        return mask
+
+    def query(cur: Cursor) -> Bitmask:
+        rslt = cur.execute(f'SELECT idx FROM documents WHERE {dataset.safe_col(label)} >= :min_score;', {'min_score': min_score})
+        return Bitmask.from_ids((r['idx'] for r in rslt), dataset.total)
+
+    return await dataset.run(query)
+
+
+async def group_mask(dataset: Dataset, group: str, min_score: float = 0.5) -> Bitmask:
+    """
+    Documents with a score of at least `min_score` for any label in `group` (including its subgroups).
+    """
+    labels = dataset.unwrap_column(group)
+    if len(labels) == 0:
+        raise ValueError(f'Invalid group: {group}')
+
+    def from_scores() -> Bitmask | None:
+        scores = dataset.scores
+        if scores is None or not all(label in scores for label in labels):
+            return None
+        rows = [scores.index[label] for label in labels]
+        return Bitmask.from_bool(np.any(scores.scores[rows] >= np.float64(min_score), axis=0))
+
+    if (mask := await run_in_executor(from_scores)) is not None:
+        return mask
+
+    masks = [await label_mask(dataset, label, min_score) for label in labels]
+    return reduce(lambda a, b: a | b, masks)
+
+
+async def search_mask(dataset: Dataset, query: str, fields: list[str]) -> Bitmask:
+    """
+    Documents matching the full-text search `query` in any of the given `fields`.
+    """
+    match = fts_query(dataset, query, fields)
+
+    def search(cur: Cursor) -> Bitmask:
+        rslt = cur.execute(f'SELECT {dataset.search_id} AS idx FROM search WHERE search MATCH :query;', {'query': match})
+        return Bitmask.from_ids((r['idx'] for r in rslt), dataset.total)
+
+    return await dataset.run(search)
+
+
+def years_mask(dataset: Dataset, start: int | None, end: int | None) -> Bitmask:
+    """
+    Documents published between `start` and `end` (both inclusive, open if None).
+    """
+    years = dataset.years
+    mask = years > 0
+    if start is not None:
+        mask &= years >= start
+    if end is not None:
+        mask &= years <= end
+    return Bitmask.from_bool(mask)
+
+
+class _Node(BaseModel):
+    model_config = ConfigDict(extra='forbid', populate_by_name=True)
+
+
+class LabelLeaf(_Node):
+    label: str
+    min_score: float = 0.5
+
+
+class GroupLeaf(_Node):
+    group: str
+    min_score: float = 0.5
+
+
+class SearchLeaf(_Node):
+    search: str
+    fields: list[str] = ['title', 'abstract']
+
+    @field_validator('search')
+    @classmethod
+    def _normalise_search(cls, search: str) -> str:
+        return normalise_query(search)
+
+    @field_validator('fields')
+    @classmethod
+    def _normalise_fields(cls, fields: list[str]) -> list[str]:
+        return sorted(set(fields))
+
+
+class YearsLeaf(_Node):
+    years: tuple[int | None, int | None]  # inclusive range (start, end)
+
+
+class BitmaskLeaf(_Node):
+    bitmask: str  # base64-encoded bitmask (e.g. a selection made in the frontend)
+
+
+class AndNode(_Node):
+    and_: list['MaskExpression'] = Field(alias='and', min_length=1)
+
+
+class OrNode(_Node):
+    or_: list['MaskExpression'] = Field(alias='or', min_length=1)
+
+
+class NotNode(_Node):
+    not_: 'MaskExpression' = Field(alias='not')
+
+
+MaskExpression = LabelLeaf | GroupLeaf | SearchLeaf | YearsLeaf | BitmaskLeaf | AndNode | OrNode | NotNode
+
+AndNode.model_rebuild()
+OrNode.model_rebuild()
+NotNode.model_rebuild()
+
+
+def canonical(expr: MaskExpression) -> str:
+    """
+    Canonical string representation of an expression; AND/OR are commutative, so their operands are sorted.
+    """
+    if isinstance(expr, AndNode):
+        return json.dumps({'and': sorted({canonical(e) for e in expr.and_})})
+    if isinstance(expr, OrNode):
+        return json.dumps({'or': sorted({canonical(e) for e in expr.or_})})
+    if isinstance(expr, NotNode):
+        return json.dumps({'not': canonical(expr.not_)})
+    return expr.model_dump_json(by_alias=True)
+
+
+def count_nodes(expr: MaskExpression) -> int:
+    if isinstance(expr, AndNode):
+        return 1 + sum(count_nodes(e) for e in expr.and_)
+    if isinstance(expr, OrNode):
+        return 1 + sum(count_nodes(e) for e in expr.or_)
+    if isinstance(expr, NotNode):
+        return 1 + count_nodes(expr.not_)
+    return 1
+
+
+async def _evaluate(dataset: Dataset, expr: MaskExpression) -> Bitmask:
+    if isinstance(expr, AndNode):
+        return reduce(lambda a, b: a & b, [await evaluate(dataset, e) for e in expr.and_])
+    if isinstance(expr, OrNode):
+        return reduce(lambda a, b: a | b, [await evaluate(dataset, e) for e in expr.or_])
+    if isinstance(expr, NotNode):
+        return ~(await evaluate(dataset, expr.not_))
+    if isinstance(expr, LabelLeaf):
+        return await label_mask(dataset, expr.label, expr.min_score)
+    if isinstance(expr, GroupLeaf):
+        return await group_mask(dataset, expr.group, expr.min_score)
+    if isinstance(expr, SearchLeaf):
+        return await search_mask(dataset, expr.search, expr.fields)
+    if isinstance(expr, YearsLeaf):
+        return await run_in_executor(years_mask, dataset, *expr.years)
+    if isinstance(expr, BitmaskLeaf):
+        # Cut off bits beyond the dataset, shorter masks are zero-padded to `dataset.total` (so negating them works)
+        bits = Bitmask.from_base64(expr.bitmask).bits[: Bitmask.n_bytes(dataset.total)]
+        return Bitmask(bits, dataset.total)
+    raise ValueError(f'Unknown expression: {expr}')
+
+
+async def evaluate(dataset: Dataset, expr: MaskExpression) -> Bitmask:
+    """
+    Evaluate a mask expression, caching the result of every sub-expression.
+    """
+    if isinstance(expr, BitmaskLeaf):
+        # No point in caching something the client sent us anyway
+        return await _evaluate(dataset, expr)
+    if isinstance(expr, LabelLeaf) and (mask := await run_in_executor(precomputed_mask, dataset, expr.label, expr.min_score)) is not None:
+        # ... or something that is precomputed on disk already (that would only take cache space from other masks)
+        return mask
+
+    # Searches are cached separately (with their own quota and TTL), so type-ahead queries can't evict other masks
+    backend, expire = (search_memory, settings.SEARCH_CACHE_EXPIRE) if isinstance(expr, SearchLeaf) else (memory, settings.MASK_CACHE_EXPIRE)
+    digest = hashlib.blake2b(canonical(expr).encode(), digest_size=16).hexdigest()
+    cache_key = f'{dataset.cache_namespace}:mask:{digest}'
+    try:
+        cached = await backend.get(cache_key)
+        if cached is not None:
+            return Bitmask.from_bytes(cached, dataset.total)
+    except Exception:
+        logger.warning(f"Error retrieving cache key '{cache_key}' from backend:", exc_info=True)
+
+    async def compute() -> Bitmask:
+        mask = await _evaluate(dataset, expr)
+        try:
+            await backend.set(cache_key, mask.to_bytes(), expire)
+        except Exception:
+            logger.warning(f"Error setting cache key '{cache_key}' in backend:", exc_info=True)
+        return mask
+
+    # Concurrent requests for the same (popular) mask share one computation
+    return await in_flight.run(cache_key, compute)
+
+
+__all__ = [
+    'MaskExpression',
+    'LabelLeaf',
+    'GroupLeaf',
+    'SearchLeaf',
+    'YearsLeaf',
+    'BitmaskLeaf',
+    'AndNode',
+    'OrNode',
+    'NotNode',
+    'evaluate',
+    'count_nodes',
+    'precomputed_mask',
+    'label_mask',
+    'group_mask',
+    'search_mask',
+    'years_mask',
+]
@@ -0,0 +1,90 @@
+import numpy as np
+import numpy.typing as npt
+
+from .bitmask import Bitmask
+from .scores import LabelScores
+
+# Number of positions in a sort order inspected at a time when looking for the next page
+CHUNK_SIZE = 1 << 14
+
+
+class InvalidCursorError(Exception):
+    status = 400
+
+
+def sort_order(scores: LabelScores, labels: list[str]) -> npt.NDArray[np.int32] | npt.NDArray[np.int64]:
+    """
+    Document ids sorted by descending sum of scores for `labels`, ties broken by ascending id.
+    This matches `ORDER BY ("a" + "b" + ...) DESC` in SQLite, where a missing score anywhere puts the document last.
+    """
+    relevance = np.zeros(scores.total, dtype=np.float64)
+    for label in labels:
+        relevance += scores.scores[scores.index[label]]
+    order = np.argsort(np.where(np.isnan(relevance), np.inf, -relevance), kind='stable')
+    if scores.total < np.iinfo(np.int32).max:
+        return order.astype(np.int32)
+    return order.astype(np.int64)
+
+
+def page_in_order(
+    order: npt.NDArray[np.integer] | None,
+    mask: Bitmask | None,
+    total: int,
+    start: int,
+    limit: int,
+    skip: int = 0,
+) -> tuple[npt.NDArray[np.int64], int | None]:
+    """
+    Find the next `limit` documents in `order` (or in id order if None) at or after position `start`
+    that are in `mask` (if given), after skipping the first `skip` of them.
+
+    Returns the ids and the position to continue from (None if the end was reached).
+    The work is proportional to the number of positions inspected, not to `start`.
+    """
+    size = total if order is None else len(order)
+    if limit <= 0:
+        return np.zeros(0, dtype=np.int64), (start if start < size else None)
+    if mask is None:
+        start, skip = start + skip, 0
+    found: list[npt.NDArray[np.int64]] = []
+    n_found = 0
+    pos = start
+    while pos < size:
+        end = min(pos + CHUNK_SIZE, size)
+        ids = np.arange(pos, end, dtype=np.int64) if order is None else order[pos:end].astype(np.int64)
+        hits = np.flatnonzero(mask.contains(ids)) if mask is not None else np.arange(len(ids))
+        if skip >= len(hits):
+            skip -= len(hits)
+            pos = end
+            continue
+        hits = hits[skip : skip + limit - n_found]
+        skip = 0
+        found.append(ids[hits])
+        n_found += len(hits)
+        if n_found >= limit:
+            pos += int(hits[-1]) + 1
+            break
+        pos = end
+
+    ids = np.concatenate(found) if len(found) > 0 else np.zeros(0, dtype=np.int64)
+    return ids, (pos if pos < size else None)
+
+
+def encode_cursor(version: str, position: int) -> str:
+    return f'{version}.{position}'
+
+
+def decode_cursor(cursor: str, version: str) -> int:
+    """
+    Position encoded in `cursor`; cursors are only valid for the dataset version they were issued for.
+    """
+    cursor_version, _, position = cursor.partition('.')
+    if cursor_version != version:
+        raise InvalidCursorError('Cursor is outdated, please start from the first page.')
+    try:
+        return int(position)
+    except ValueError:
+        raise InvalidCursorError('Invalid cursor')
+
+
+__all__ = ['sort_order', 'page_in_order', 'encode_cursor', 'decode_cursor', 'InvalidCursorError']
@@ -0,0 +1,138 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import numpy.typing as npt
+
+from .logging import get_logger
+
+logger = get_logger('util.scores')
+
+BATCH_SIZE = 50000
+
+
+class LabelScores:
+    """
+    Column-oriented copy of all label scores of a dataset with shape (labels, documents).
+    Missing scores (NULL in the database) are NaN, so they never pass a threshold.
+
+    The matrix is stored as a sidecar `.npy` file next to the database and memory-mapped,
+    so that all worker processes share the same pages.
+    It is stored as float16 (which is what the export writers produce) unless that would lose precision,
+    in which case it is float32 or (if even that is not exact) float64.
+    """
+
+    def __init__(self, labels: list[str], scores: npt.NDArray[np.floating[Any]]):
+        self.labels = labels
+        self.index = {label: i for i, label in enumerate(labels)}
+        self.scores = scores
+
+    @property
+    def total(self) -> int:
+        return int(self.scores.shape[1])
+
+    def __contains__(self, label: str) -> bool:
+        return label in self.index
+
+    def mask(self, label: str, min_score: float) -> npt.NDArray[np.bool_]:
+        # Compare in float64 to get exactly the same results as SQLite does
+        mask: npt.NDArray[np.bool_] = np.greater_equal(self.scores[self.index[label]], np.float64(min_score))
+        return mask
+
+    @classmethod
+    def from_db(cls, cur: sqlite3.Cursor, labels: list[str], total: int) -> 'LabelScores':
+        cols = ', '.join(f'"{label}"' for label in labels)
+        scores: npt.NDArray[np.floating[Any]] = np.full((len(labels), total), np.nan, dtype=np.float32)
+        lossless = True
+        rslt = cur.execute(f'SELECT idx, {cols} FROM documents;')
+        while batch := rslt.fetchmany(BATCH_SIZE):
+            values = np.array([tuple(r) for r in batch], dtype=np.float64)
+            idxs = values[:, 0].astype(np.int64)
+            values = values[:, 1:].T
+            if scores.dtype == np.float32 and not np.array_equal(values.astype(np.float32), values, equal_nan=True):
+                # Rounding could move a score to the other side of a threshold (unlike in SQLite), so keep all digits
+                scores = scores.astype(np.float64)
+            lossless = lossless and np.array_equal(values.astype(np.float16), values, equal_nan=True)
+            scores[:, idxs] = values
+        if lossless:
+            return cls(labels, scores.astype(np.float16))
+        logger.warning(f'Scores are not representable as float16, keeping {scores.dtype} precision.')
+        return cls(labels, scores)
+
+    @classmethod
+    def load(cls, cur: sqlite3.Cursor, sidecar: Path, labels: list[str], total: int, version: str) -> 'LabelScores':
+        """
+        Memory-map the score matrix from `sidecar` or (re-)build it from the database if it is missing or outdated.
+        """
+        logger.debug(f'Loading label scores for {len(labels)} labels and {total:,} documents')
+        scores = load_sidecar(
+            sidecar,
+            meta={'version': version, 'labels': labels, 'total': total},
+            build=lambda: cls.from_db(cur, labels, total).scores,
+        )
+        return cls(labels, scores)
+
+
+def load_years(cur: sqlite3.Cursor, sidecar: Path, total: int, version: str) -> npt.NDArray[np.int16]:
+    """
+    Publication year per document (0 if unknown), memory-mapped from `sidecar` or built from the database.
+    """
+
+    def build() -> npt.NDArray[np.int16]:
+        years = np.zeros(total, dtype=np.int16)
+        rslt = cur.execute('SELECT idx, publication_year FROM documents WHERE publication_year IS NOT NULL;')
+        while batch := rslt.fetchmany(BATCH_SIZE):
+            values = np.array([tuple(r) for r in batch], dtype=np.int64)
+            years[values[:, 0]] = values[:, 1]
+        return years
+
+    return load_sidecar(sidecar, meta={'version': version, 'total': total}, build=build)
+
+
+def load_sidecar(sidecar: Path, meta: dict[str, Any], build: Callable[[], npt.NDArray[Any]]) -> npt.NDArray[Any]:
+    """
+    Memory-map the array stored for `meta` next to `sidecar` (the file name contains a digest of `meta`),
+    otherwise `build` it and try to store it for next time (or other workers).
+    A single file per version means a worker can never pair an array with the meta-data of another one.
+    """
+    digest = hashlib.blake2b(json.dumps(meta, sort_keys=True).encode(), digest_size=8).hexdigest()
+    path = sidecar.with_name(f'{sidecar.stem}.{digest}{sidecar.suffix}')
+    if path.exists():
+        try:
+            logger.debug(f'Memory-mapping {path}')
+            return np.load(path, mmap_mode='r')  # type: ignore[no-any-return]
+        except (OSError, ValueError) as e:
+            logger.warning(f'Failed to read sidecar {path}: {e}')
+
+    logger.info(f'Building {path.name}')
+    array = build()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so concurrently starting workers never see partial files
+        tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+        mapped: npt.NDArray[Any] = np.load(path, mmap_mode='r')
+    except OSError as e:
+        logger.warning(f'Failed to write sidecar {path}, keeping it in memory: {e}')
+        return array
+
+    # Drop outdated versions (and the meta-data files of older releases); workers that still map them keep their pages
+    stale = [*sidecar.parent.glob(f'{glob.escape(sidecar.stem)}.*{sidecar.suffix}'), sidecar, sidecar.with_suffix('.json')]
+    for file in stale:
+        if file != path and file.exists():
+            try:
+                file.unlink()
+            except OSError as e:
+                logger.debug(f'Failed to remove outdated sidecar {file}: {e}')
+    return mapped
+
+
+__all__ = ['LabelScores', 'load_years', 'load_sidecar']
@@ -0,0 +1,90 @@
+import html
+import re
+from sqlite3 import Cursor
+
+from pydantic import BaseModel
+
+from lithub.models import AnnotatedDocument
+from .bitmask import Bitmask
+from .datasets import Dataset
+from .util import ids_param
+
+SNIPPET_TOKENS = 32  # maximum number of tokens in a snippet
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+# Private-use characters marking matches in FTS5 snippets, replaced by the tags above after escaping the text
+_MATCH_START = '\ue000'
+_MATCH_END = '\ue001'
+
+
+# FTS5 operators are case-sensitive, everything else is case-insensitive with the tokenizers we use
+OPERATORS = {'AND', 'OR', 'NOT'}
+
+
+def _normalise_term(match: re.Match[str]) -> str:
+    term = match.group()
+    return term if term in OPERATORS or term.startswith('NEAR') else term.lower()
+
+
+def normalise_query(query: str) -> str:
+    """
+    Equivalent, canonical form of an FTS5 query (for caching): whitespace is collapsed and terms are lowercased,
+    but operators (and `NEAR` groups) are kept as they are.
+    """
+    # Odd parts are "quoted phrases"
+    parts = re.split(r'("[^"]*")', query)
+    normalised = [part.lower() if i % 2 == 1 else re.sub(r'[^\s()"]+', _normalise_term, part) for i, part in enumerate(parts)]
+    return re.sub(r'\s+', ' ', ''.join(normalised)).strip()
+
+
+class SearchHit(BaseModel):
+    score: float  # BM25 relevance (higher is better)
+    snippet: str  # HTML-escaped excerpt of the best matching field, matches wrapped in `<mark>`
+    document: AnnotatedDocument
+
+
+def fts_query(dataset: Dataset, query: str, fields: list[str] | None = None) -> str:
+    """
+    FTS5 query matching `query` in any of `fields` (or all searchable columns if None) using a single column filter.
+    """
+    if fields is None or len(fields) == 0:
+        return query
+    for field in fields:
+        if field not in dataset.search_columns:
+            raise ValueError(f'Invalid search field: {field}')
+    return f'{{{" ".join(fields)}}} : ({query})'
+
+
+def _highlight(snippet: str) -> str:
+    # Document text is untrusted, so escape it before adding our own markup
+    return html.escape(snippet).replace(_MATCH_START, HIGHLIGHT_START).replace(_MATCH_END, HIGHLIGHT_END)
+
+
+def ranked_matches(
+    cur: Cursor,
+    dataset: Dataset,
+    query: str,
+    fields: list[str] | None = None,
+    mask: Bitmask | None = None,
+    limit: int = 10,
+    offset: int = 0,
+) -> list[tuple[int, float, str]]:
+    """
+    Ids, BM25 scores, and snippets of documents matching `query` (and in `mask`, if given), best matches first.
+    """
+    where = 'search MATCH :query'
+    params: dict[str, str | int] = {'query': fts_query(dataset, query, fields), 'limit': limit, 'offset': offset}
+    if mask is not None:
+        where += f' AND {dataset.search_id} IN (SELECT value FROM json_each(:ids))'
+        params['ids'] = ids_param(mask.ids())
+
+    rslt = cur.execute(
+        f'SELECT {dataset.search_id} AS idx, rank, snippet(search, -1, :hl_start, :hl_end, :ellipsis, :tokens) AS snippet '
+        f'FROM search WHERE {where} ORDER BY rank LIMIT :limit OFFSET :offset;',
+        {**params, 'hl_start': _MATCH_START, 'hl_end': _MATCH_END, 'ellipsis': '…', 'tokens': SNIPPET_TOKENS},
+    )
+    # FTS5's rank is the negated BM25 score (so that ascending order is best first)
+    return [(r['idx'], -r['rank'], _highlight(r['snippet'] or '')) for r in rslt]
+
+
+__all__ = ['SearchHit', 'normalise_query', 'fts_query', 'ranked_matches']
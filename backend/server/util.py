@@ -1,36 +1,35 @@
-import base64
-from array import array
-from typing import Iterable, TypeVar, Generator
+import gzip
+import hashlib
+import json
+from typing import Iterable, TypeVar
 
+import numpy as np
+import numpy.typing as npt
 
-def as_bitmask(ids: Iterable[int], total: int) -> bytes:
-    # https://wiki.python.org/moin/BitArrays
-    intSize = total >> 5  # number of 32 bit integers
-    if total & 31:  # if bitSize != (32 * n) add
-        intSize += 1  # a record for stragglers
-    bitmask = array('I')  # 'I' = unsigned 32-bit integer
-    bitmask.extend((0,) * intSize)
+from .bitmask import Bitmask
+
+# Constant SQL fragment to select documents by a set of ids bound as JSON array to `:ids`.
+# Unlike inlined `IN (1, 2, ...)` lists, the statement text never changes (so it stays in the statement cache)
+# and it is not subject to SQLite's limits on SQL length or number of parameters.
+IDS_FILTER = 'idx IN (SELECT value FROM json_each(:ids))'
 
-    def set_bit(idx: int) -> None:
-        record = idx >> 5
-        offset = idx & 31
-        mask = 1 << offset
-        bitmask[record] |= mask
 
-    [set_bit(idx_) for idx_ in ids]  # type: ignore[func-returns-value]
-    return base64.b64encode(bitmask)
+def ids_param(ids: Iterable[int] | npt.NDArray[np.int64]) -> str:
+    """
+    Serialise document ids for binding to `IDS_FILTER`.
+    """
+    if isinstance(ids, np.ndarray):
+        ids = ids.tolist()
+    # casting to int first, so nothing but numbers ends up in the parameter
+    return json.dumps([int(i) for i in ids])
 
 
-def as_ids(bitmask_str: str) -> list[int]:
-    bitmask = array('I', base64.b64decode(bitmask_str))
+def as_bitmask(ids: Iterable[int], total: int) -> bytes:
+    return Bitmask.from_ids(ids, total).to_base64()
 
-    def is_set(idx: int) -> bool:
-        record = idx >> 5
-        offset = idx & 31
-        mask = 1 << offset
-        return bool(bitmask[record] & mask)
 
-    return [idx for idx in range(len(bitmask) * 32) if is_set(idx)]
+def as_ids(bitmask_str: str) -> list[int]:
+    return Bitmask.from_base64(bitmask_str).ids().tolist()  # type: ignore[no-any-return]
 
 
 def as_ids_lim(bitmask_str: str, limit: int | None = None) -> list[int]:
@@ -42,25 +41,7 @@ def as_ids_lim(bitmask_str: str, limit: int | None = None) -> list[int]:
     :param limit:
     :return:
     """
-    bitmask = array('I', base64.b64decode(bitmask_str))
-    if limit is None:
-        limit = len(bitmask) * 32
-
-    def is_set(idx: int) -> bool:
-        record = idx >> 5
-        offset = idx & 31
-        mask = 1 << offset
-        return bool(bitmask[record] & mask)
-
-    def gen() -> Generator[int, None, None]:
-        cnt = 0
-        for idx in range(len(bitmask) * 32):
-            if is_set(idx):
-                yield idx
-                if cnt > limit:
-                    break
-
-    return list(gen())
+    return Bitmask.from_base64(bitmask_str).ids(limit=limit).tolist()  # type: ignore[no-any-return]
 
 
 T = TypeVar('T')
@@ -74,3 +55,35 @@ def as_batches(it: Iterable[T], batch_size: int) -> Iterable[list[T]]:
             yield batch
             batch = []
     yield batch
+
+
+def content_etag(content: bytes) -> str:
+    """
+    Strong ETag derived from the content only, so it is the same in every worker and after restarts.
+    """
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Whether `etag` is listed in an `If-None-Match` header (using weak comparison, as the header requires).
+    """
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+class Payload:
+    """
+    Response body serialised once, kept together with its gzip-compressed variant and strong content-hash ETags (one each).
+    """
+
+    def __init__(self, content: bytes, media_type: str = 'application/json'):
+        self.content = content
+        self.media_type = media_type
+        # mtime=0 keeps the compressed bytes identical across workers and restarts
+        self.gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+        self.etag = content_etag(content)
+        # Strong validators have to differ per content-coding
+        self.gzipped_etag = f'{self.etag[:-1]}-gz"'
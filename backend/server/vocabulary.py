@@ -0,0 +1,74 @@
+from bisect import bisect_left
+from itertools import groupby
+from sqlite3 import Cursor
+
+import numpy as np
+import numpy.typing as npt
+from pydantic import BaseModel
+
+
+class Suggestion(BaseModel):
+    term: str
+    count: int  # number of documents containing the term
+
+
+class Vocabulary:
+    """
+    All terms of the full-text search index with their document frequencies, for type-ahead suggestions.
+
+    Terms are kept sorted, so completions of a prefix are a contiguous range found by binary search.
+    Short prefixes match huge ranges, so their top completions are precomputed.
+    """
+
+    def __init__(self, terms: list[str], counts: npt.NDArray[np.int64], top_n: int = 50, short_prefix: int = 2):
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        self.terms = [terms[i] for i in order]
+        self.counts = counts[order]
+        self.top_n = top_n
+        self.short_prefix = short_prefix
+        self._top: dict[str, npt.NDArray[np.int64]] = {}
+        for length in range(1, short_prefix + 1):
+            for prefix, group in groupby(range(len(self.terms)), key=lambda i: self.terms[i][:length]):
+                idxs = np.fromiter(group, dtype=np.int64)
+                # Terms shorter than `length` are their own group, which is part of a shorter prefix's group
+                if len(prefix) == length:
+                    self._top[prefix] = self._best(idxs[0], idxs[-1] + 1, top_n)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _best(self, lo: int, hi: int, n: int) -> npt.NDArray[np.int64]:
+        # Indices of the `n` most frequent terms in [lo, hi), most frequent (then alphabetically) first
+        counts = self.counts[lo:hi]
+        if len(counts) > n:
+            candidates = np.argpartition(-counts, n - 1)[:n]
+        else:
+            candidates = np.arange(len(counts))
+        return lo + candidates[np.lexsort((candidates, -counts[candidates]))]
+
+    def complete(self, prefix: str, limit: int = 10) -> list[Suggestion]:
+        prefix = prefix.lower()
+        if len(prefix) == 0:
+            return []
+        if len(prefix) <= self.short_prefix and limit <= self.top_n:
+            best = self._top.get(prefix, np.zeros(0, dtype=np.int64))[:limit]
+        else:
+            lo = bisect_left(self.terms, prefix)
+            hi = bisect_left(self.terms, prefix + '\U0010ffff', lo)
+            best = self._best(lo, hi, limit)
+        return [Suggestion(term=self.terms[i], count=int(self.counts[i])) for i in best.tolist()]
+
+    @classmethod
+    def from_db(cls, cur: Cursor, min_docs: int = 1) -> 'Vocabulary':
+        cur.execute('CREATE VIRTUAL TABLE IF NOT EXISTS temp.search_vocab USING fts5vocab(main, search, row);')
+        terms: list[str] = []
+        counts: list[int] = []
+        rslt = cur.execute('SELECT term, doc FROM temp.search_vocab WHERE doc >= :min_docs;', {'min_docs': min_docs})
+        while batch := rslt.fetchmany(50000):
+            for row in batch:
+                terms.append(row['term'])
+                counts.append(row['doc'])
+        return cls(terms, np.array(counts, dtype=np.int64))
+
+
+__all__ = ['Suggestion', 'Vocabulary']
@@ -1,12 +1,16 @@
 import logging
 from pathlib import Path
+from typing import Any
 
+import numpy as np
+import numpy.typing as npt
 import pandas as pd
 import pyarrow as pa
 from sqlalchemy import create_engine, text, types
 
-from lithub.models import Label
+from lithub.models import DatasetInfoFull, DatasetManifest, Label, ManifestFile, SchemeGroup
 from lithub.geographies import get_naming_mask, fix_geographies, FEATURE_LOOKUP
+from lithub.util.bitmaps import DEFAULT_THRESHOLDS, entry_key, write_bitmap_file
 
 CHUNK_SIZE = 10000
 
@@ -74,7 +78,12 @@ def write_sqlite(
     target: Path,
     LABELS_LOOKUP: dict[str, Label],
     logger: logging.Logger | None = None,
+    tokenizer: str = 'unicode61',
 ) -> None:
+    """
+    Write documents to a SQLite database with a full-text search index on title, abstract, and authors.
+    The `tokenizer` is passed on to FTS5 (e.g. `porter unicode61` for English stemming).
+    """
     logger = logger or logging.getLogger('lithub.write')
     logger.info('Preparing SQLite schema...')
     label_columns = [key for key in LABELS_LOOKUP.keys() if key in df.columns]
@@ -102,14 +111,23 @@ def write_sqlite(
 
     logger.info('Indexing data in sqlite...')
     with engine.connect() as con:
-        # Set up search on title, text, authors
-        con.execute(text('CREATE VIRTUAL TABLE search USING fts5(idx, title, abstract, authors);'))
-        # Indexing data
+        # Lookups of id sets (`idx IN (SELECT value FROM json_each(:ids))`) by the API
+        con.execute(text('CREATE UNIQUE INDEX ix_documents_idx ON documents (idx);'))
+        # Set up search on title, text, authors as external-content table (text is read from `documents` instead of
+        # being stored twice), using `idx` as rowid, so that matches can be mapped to documents without lookups.
+        # Prefix indexes speed up prefix queries (`carb*`) as typed when using suggestions.
+        tokenizer = tokenizer.replace("'", "''")
         con.execute(
             text(
-                'INSERT INTO search (idx, title, abstract, authors) SELECT idx, title, abstract, authors FROM documents;',
+                'CREATE VIRTUAL TABLE search USING fts5('
+                f"idx UNINDEXED, title, abstract, authors, content='documents', content_rowid='idx', tokenize='{tokenizer}', prefix='2 3 4'"
+                ');'
             ),
         )
+        # Indexing data
+        con.execute(text("INSERT INTO search (search) VALUES ('rebuild');"))
+        # Merge all index segments into one
+        con.execute(text("INSERT INTO search (search) VALUES ('optimize');"))
         con.commit()
 
         rslt = con.execute(text('PRAGMA table_info(documents);')).fetchall()
@@ -119,6 +137,94 @@ def write_sqlite(
     logger.info(f'Wrote sqlite file to {target}')
 
 
+def write_bitmaps(
+    df: pd.DataFrame,
+    target: Path,
+    LABELS_LOOKUP: dict[str, Label],
+    thresholds: tuple[float, ...] = DEFAULT_THRESHOLDS,
+    logger: logging.Logger | None = None,
+) -> None:
+    """
+    Precompute the document mask for each label at each threshold and write them as a bitmap sidecar file.
+    Reference the file from `info.json` via `bitmaps_filename`, so the server can serve masks without touching SQLite.
+    """
+    logger = logger or logging.getLogger('lithub.write')
+    label_columns = [key for key in LABELS_LOOKUP.keys() if key in df.columns]
+    total = df.shape[0]
+    idxs = df['idx'].to_numpy(dtype=np.int64)
+    logger.info(f'Writing bitmaps for {len(label_columns)} labels at thresholds {thresholds} to {target}')
+
+    masks = {}
+    for label in label_columns:
+        # compare in float64, just like SQLite would
+        scores = df[label].to_numpy(dtype=np.float64, na_value=np.nan)
+        for threshold in thresholds:
+            mask = np.zeros(total, dtype=bool)
+            mask[idxs[scores >= threshold]] = True
+            masks[entry_key(label, threshold)] = mask
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    write_bitmap_file(target, masks=masks, total=total, thresholds=thresholds)
+    logger.info(f'Wrote bitmaps to {target}')
+
+
+def _resolve_group_labels(GROUPS: dict[str, SchemeGroup], key: str) -> list[str]:
+    group = GROUPS[key]
+    if group.labels is not None:
+        return group.labels
+    return [label for subgroup in group.subgroups or [] for label in _resolve_group_labels(GROUPS, subgroup)]
+
+
+def write_cube(
+    df: pd.DataFrame,
+    target: Path,
+    LABELS_LOOKUP: dict[str, Label],
+    GROUPS: dict[str, SchemeGroup],
+    thresholds: tuple[float, ...] = DEFAULT_THRESHOLDS,
+    logger: logging.Logger | None = None,
+) -> None:
+    """
+    Count documents per label (and group) and publication year at each threshold and write the dense cube as Arrow file
+    with one row per (kind, key, threshold, year) and all years between the first and last one present in the data.
+    Reference the file from `info.json` via `cube_filename`, so the server can serve heatmaps without any masks.
+    """
+    logger = logger or logging.getLogger('lithub.write')
+    label_columns = [key for key in LABELS_LOOKUP.keys() if key in df.columns]
+    years = df['publication_year'].to_numpy(dtype=np.float64, na_value=np.nan)
+    known = ~np.isnan(years)
+    first_year, last_year = (int(years[known].min()), int(years[known].max())) if known.any() else (0, -1)
+    year_range = np.arange(first_year, last_year + 1)
+    year_idx = (years[known] - first_year).astype(np.int64)
+    logger.info(f'Writing label x year cube for {len(label_columns)} labels and {len(GROUPS)} groups ({first_year}-{last_year}) to {target}')
+
+    # compare in float64, just like SQLite would
+    scores = {label: df[label].to_numpy(dtype=np.float64, na_value=np.nan)[known] for label in label_columns}
+    columns: dict[str, list[Any]] = {'kind': [], 'key': [], 'threshold': [], 'year': [], 'count': []}
+
+    def append(kind: str, key: str, threshold: float, mask: npt.NDArray[np.bool_]) -> None:
+        counts = np.bincount(year_idx[mask], minlength=len(year_range))
+        columns['kind'] += [kind] * len(year_range)
+        columns['key'] += [key] * len(year_range)
+        columns['threshold'] += [float(threshold)] * len(year_range)
+        columns['year'] += year_range.tolist()
+        columns['count'] += counts.tolist()
+
+    for threshold in thresholds:
+        for label in label_columns:
+            append('label', label, threshold, scores[label] >= threshold)
+        for key in GROUPS.keys():
+            group_labels = [label for label in _resolve_group_labels(GROUPS, key) if label in scores]
+            if len(group_labels) > 0:
+                append('group', key, threshold, np.any([scores[label] >= threshold for label in group_labels], axis=0))
+
+    schema = pa.schema([('kind', pa.string()), ('key', pa.string()), ('threshold', pa.float64()), ('year', pa.int16()), ('count', pa.int64())])
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with pa.OSFile(target.as_posix(), 'wb') as sink:
+        with pa.ipc.new_file(sink, schema=schema) as writer:
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+    logger.info(f'Wrote cube to {target}')
+
+
 def write_base_info(
     df: pd.DataFrame,
     target: Path,
@@ -189,3 +295,42 @@ def write_geographies(
         ),
         chunk_size=chunk_size,
     )
+
+
+def write_manifest(
+    folder: Path,
+    logger: logging.Logger | None = None,
+) -> None:
+    """
+    Write `manifest.json` with the number of documents, the columns, and size and hash of all files referenced by
+    `info.json` in `folder`, so the server can start up without probing the database (see `DatasetManifest`).
+    Run this last, after all other files of the dataset were written.
+    """
+    logger = logger or logging.getLogger('lithub.write')
+    with open(folder / 'info.json', 'r') as f:
+        info = DatasetInfoFull.model_validate_json(f.read())
+
+    engine = create_engine(f'sqlite:///{folder / info.db_filename}', echo=False)
+    with engine.connect() as con:
+        total = con.execute(text('SELECT COUNT(1) FROM documents;')).scalar_one()
+        columns = [r[1] for r in con.execute(text('PRAGMA table_info(documents);')).fetchall()]
+
+    files = {}
+    for name in [
+        info.db_filename,
+        info.arrow_filename,
+        info.keywords_filename,
+        info.bitmaps_filename,
+        info.cube_filename,
+        info.slim_geo_filename,
+        info.full_geo_filename,
+    ]:
+        if name is not None and (folder / name).exists():
+            logger.debug(f'Hashing {name}')
+            stat = (folder / name).stat()
+            files[name] = ManifestFile(size=stat.st_size, mtime_ns=stat.st_mtime_ns, blake2b=ManifestFile.digest(folder / name))
+
+    manifest = DatasetManifest(total=total, columns=columns, files=files)
+    with open(folder / 'manifest.json', 'w') as f:
+        f.write(manifest.model_dump_json(indent=2))
+    logger.info(f'Wrote manifest for {total:,} documents and {len(files)} files to {folder / "manifest.json"}')
@@ -1,5 +1,5 @@
 from .labels import Label, Group
-from .info import Document, DatasetInfoFull, DatasetInfoWeb, SchemeGroup, SchemeLabel, DatasetInfo, AnnotatedDocument
+from .info import Document, DatasetInfoFull, DatasetInfoWeb, SchemeGroup, SchemeLabel, DatasetInfo, AnnotatedDocument, DatasetManifest, ManifestFile
 
 __all__ = [
     'Label',
@@ -11,4 +11,6 @@ __all__ = [
     'DatasetInfo',
     'SchemeLabel',
     'AnnotatedDocument',
+    'DatasetManifest',
+    'ManifestFile',
 ]
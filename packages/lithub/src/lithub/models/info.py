@@ -1,7 +1,9 @@
+import hashlib
 from datetime import date
+from pathlib import Path
 from typing import Literal, Annotated
 
-from pydantic import BaseModel, ConfigDict, AfterValidator
+from pydantic import BaseModel, ConfigDict, AfterValidator, field_serializer
 
 
 class SchemeLabel(BaseModel):
@@ -45,6 +47,8 @@ class _DatasetInfoFull(DatasetInfo):
     db_filename: str
     arrow_filename: str
     keywords_filename: str | None = None
+    bitmaps_filename: str | None = None  # precomputed label masks (see `lithub.util.bitmaps`)
+    cube_filename: str | None = None  # precomputed label/group x year counts (see `lithub.export.writers.write_cube`)
 
     slim_geo_filename: str | None = None
     full_geo_filename: str | None = None
@@ -71,6 +75,36 @@ class DatasetInfoWeb(DatasetInfoFull):
     label_columns: set[str]
     document_columns: set[str]
 
+    @field_serializer('columns', 'label_columns', 'document_columns')
+    def _sorted(self, columns: set[str]) -> list[str]:
+        # Set order depends on the (per-process) hash seed, sorting keeps the payload (and its ETag) identical across workers
+        return sorted(columns)
+
+
+class ManifestFile(BaseModel):
+    size: int  # in bytes
+    mtime_ns: int  # modification time (replaced files often keep their size, e.g. SQLite files are multiples of the page size)
+    blake2b: str  # hex digest of the file contents
+
+    @staticmethod
+    def digest(source: Path, chunk_size: int = 1 << 20) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        with open(source, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                h.update(chunk)
+        return h.hexdigest()
+
+
+class DatasetManifest(BaseModel):
+    """
+    Facts about an exported dataset that are expensive to probe at startup (see `lithub.export.writers.write_manifest`).
+    """
+
+    model_config = ConfigDict(extra='ignore')
+    total: int  # number of documents
+    columns: list[str]  # columns of the `documents` table
+    files: dict[str, ManifestFile]  # per file name (relative to the dataset folder)
+
 
 class Document(BaseModel):
     idx: int
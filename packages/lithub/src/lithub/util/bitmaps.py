@@ -0,0 +1,103 @@
+"""
+Bitmap sidecar files: precomputed, bit-packed document masks per label and threshold.
+
+Layout (all integers little-endian):
+    4 bytes   magic `LHBM`
+    4 bytes   uint32 format version
+    4 bytes   uint32 length of the JSON header
+    n bytes   JSON header {'total': int, 'n_bytes': int, 'labels': [...], 'thresholds': [...], 'entries': ['label@threshold', ...]}
+    padding   zeros up to the next multiple of 8 bytes
+    masks     one mask of `n_bytes` bytes per entry, in the order of `entries`
+
+Each mask uses the same layout as the API bitmasks: an array of unsigned 32-bit integers,
+where bit `idx & 31` of word `idx >> 5` is set for document `idx`.
+"""
+
+import json
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+
+MAGIC = b'LHBM'
+FORMAT_VERSION = 1
+DEFAULT_THRESHOLDS = (0.25, 0.5, 0.75)
+
+_PREAMBLE = struct.Struct('<4sII')
+
+
+def entry_key(label: str, threshold: float) -> str:
+    return f'{label}@{float(threshold)!r}'
+
+
+def pack_mask(mask: npt.NDArray[np.bool_]) -> bytes:
+    packed = np.packbits(mask, bitorder='little')
+    padding = -len(packed) % 4
+    if padding:
+        packed = np.concatenate([packed, np.zeros(padding, dtype=np.uint8)])
+    return packed.tobytes()
+
+
+def _data_start(header_len: int) -> int:
+    start = _PREAMBLE.size + header_len
+    return start + (-start % 8)
+
+
+def write_bitmap_file(target: Path, masks: dict[str, npt.NDArray[np.bool_]], total: int, thresholds: list[float] | tuple[float, ...]) -> None:
+    """
+    Write `masks` (keyed by `entry_key(label, threshold)`) for a dataset with `total` documents to `target`.
+    """
+    n_bytes = ((total + 31) >> 5) * 4
+    header = json.dumps(
+        {
+            'total': total,
+            'n_bytes': n_bytes,
+            'labels': sorted({key.rsplit('@', 1)[0] for key in masks.keys()}),
+            'thresholds': [float(t) for t in thresholds],
+            'entries': list(masks.keys()),
+        }
+    ).encode()
+
+    with open(target, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(b'\0' * (_data_start(len(header)) - _PREAMBLE.size - len(header)))
+        for mask in masks.values():
+            f.write(pack_mask(mask).ljust(n_bytes, b'\0'))
+
+
+class BitmapFile:
+    """
+    Read-only, memory-mapped access to a bitmap sidecar file.
+    """
+
+    def __init__(self, source: Path):
+        self.source = source
+        with open(source, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{source} is not a bitmap file')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported bitmap file version {version} in {source}')
+        header = json.loads(self._mmap[_PREAMBLE.size : _PREAMBLE.size + header_len])
+        self.total: int = header['total']
+        self.n_bytes: int = header['n_bytes']
+        self.labels: list[str] = header['labels']
+        self.thresholds: list[float] = header['thresholds']
+        start = _data_start(header_len)
+        self.offsets: dict[str, int] = {key: start + i * self.n_bytes for i, key in enumerate(header['entries'])}
+
+    def __contains__(self, item: tuple[str, float]) -> bool:
+        return entry_key(*item) in self.offsets
+
+    def get(self, label: str, threshold: float) -> memoryview | None:
+        offset = self.offsets.get(entry_key(label, threshold))
+        if offset is None:
+            return None
+        return memoryview(self._mmap)[offset : offset + self.n_bytes]
+
+    def close(self) -> None:
+        self._mmap.close()